@@ -0,0 +1,143 @@
+#!/usr/bin/env python3
+""" Render the standard scene headless for a number of frames, the ship
+    sailing in circles, and report percentiles of the update, draw and swap
+    times of every frame
+
+    $ cd src/
+    $ python3 bench.py --frames 500 --width 1280 --height 720
+
+    --straight sails straight ahead, through chunks of the world loading and
+    unloading, for instance for an hour of game time at 60 frames per second
+    $ python3 bench.py --straight --frames 216000
+
+    --idle leaves the ship drifting on the waves, no key pressed, as a player
+    reading the map would
+    $ python3 bench.py --idle
+
+    --fleet 200 adds AI ships sailing around the start, drawn with one
+    instanced call per packed model
+
+    --profile adds the CPU and GPU milliseconds per frame of the passes,
+    scene nodes and draw items, and --trace writes them as a Chrome trace
+
+    Without a display, GLFW's null platform (GLFW 3.4) and an OSMesa context
+    render with Mesa's software rasterizer, as LIBGL_ALWAYS_SOFTWARE=1 does
+    with a display
+"""
+
+import argparse
+import os
+
+import OpenGL.GL as GL
+import glfw
+import numpy as np
+
+from core.gl_state import gl_state
+from core.profiler import profiler
+from core.viewer import Viewer
+from chunks import ChunkManager
+from fleet import Fleet
+from main import build_scene, release_scene
+from player import Player
+
+
+CONTEXT_APIS = {'native': glfw.NATIVE_CONTEXT_API, 'egl': glfw.EGL_CONTEXT_API, 'osmesa': glfw.OSMESA_CONTEXT_API}
+PERCENTILES = (50, 90, 99)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Sea of Triangles headless benchmark')
+    parser.add_argument('--frames', type=int, default=300, help='number of measured frames')
+    parser.add_argument('--warmup', type=int, default=30, help='frames run before measuring')
+    parser.add_argument('--width', type=int, default=960)
+    parser.add_argument('--height', type=int, default=540)
+    parser.add_argument('--straight', action='store_true', help='sail straight ahead instead of circling')
+    parser.add_argument('--idle', action='store_true', help='press no key, the ship only riding the waves')
+    parser.add_argument('--fleet', type=int, default=0, metavar='N', help='add N instanced AI ships to the scene')
+    parser.add_argument('--delta-time', type=float, default=1 / 60, help='simulated seconds per frame')
+    parser.add_argument('--context', choices=sorted(CONTEXT_APIS),
+                        help='context creation API, native with a display and osmesa without by default')
+    parser.add_argument('--profile', action='store_true', help='time passes, nodes and draws on CPU and GPU')
+    parser.add_argument('--trace', metavar='FILE', help='write the profiled frames as a Chrome trace')
+    parser.add_argument('--record', metavar='PATH', help='record the measured frames, as main.py does')
+    parser.add_argument('--frame-budget', type=float, metavar='MS', help='dynamic resolution budget, as main.py has')
+    args = parser.parse_args()
+
+    has_display = bool(os.environ.get('DISPLAY') or os.environ.get('WAYLAND_DISPLAY'))
+    if not has_display and hasattr(glfw, 'PLATFORM_NULL'):
+        glfw.init_hint(glfw.PLATFORM, glfw.PLATFORM_NULL)
+    if not glfw.init():
+        raise SystemExit('Error: unable to initialize GLFW')
+    glfw.window_hint(glfw.CONTEXT_CREATION_API, CONTEXT_APIS[args.context or ('native' if has_display else 'osmesa')])
+
+    viewer = Viewer(args.width, args.height, 'Sea of Triangles benchmark',
+                    render_queue=True, headless=True, delta_time=args.delta_time, frame_budget=args.frame_budget)
+    lights_manager = build_scene(viewer)
+    if args.fleet:
+        player = next(child for child in lights_manager.children if isinstance(child, Player))
+        lights_manager.add(Fleet(lights_manager, player.water, args.fleet))
+    print('Renderer: {}, {}x{}, {} frames'.format(GL.glGetString(GL.GL_RENDERER).decode(),
+                                                   args.width, args.height, args.frames))
+
+    # scripted input, the parchment put away and the ship sailing forward in a circle or straight ahead
+    viewer.key_handler(glfw.KEY_H, True)
+    viewer.key_handler(glfw.KEY_H, False)
+    if not args.idle:
+        viewer.key_handler(glfw.KEY_UP, True)
+    if not args.idle and not args.straight:
+        viewer.key_handler(glfw.KEY_LEFT, True)
+
+    # headless frames end finished, and glfw time starts at glfw.init, before the scene is built
+    timings = []
+    warmup = max(args.warmup, 1)
+    viewer.run(1, timings)
+    print('First frame after {:.2f} s'.format(glfw.get_time()))
+    viewer.run(warmup - 1, timings)
+    if args.profile or args.trace:
+        profiler.enable()
+    if args.record:
+        viewer.start_recording(args.record)
+    viewer.run(args.frames, timings)
+    viewer.stop_recording()
+    report(1000 * np.array(timings[warmup:]))
+    print('Last frame: {draw_calls} draws, {program_binds} programs, {texture_binds} textures, '
+          '{material_uploads} materials'.format(
+            **gl_state.stats))
+    print('Shadow map: {shadow_renders} renders, {shadow_reuses} reuses'.format(**lights_manager.stats))
+    for child in lights_manager.children:
+        if isinstance(child, ChunkManager):
+            print('World: {chunks} chunks loaded, {visible} drawn, {pending} pending'.format(**child.stats))
+    if args.frame_budget:
+        print('Resolution: {resolution_scale:.0%} for {frame_budget} ms'.format(**viewer.stats))
+
+    if args.profile or args.trace:
+        report_profile(profiler.summary())
+    if args.trace:
+        profiler.export_trace(args.trace)
+        print('Trace written to {}'.format(args.trace))
+
+    release_scene(lights_manager)
+
+
+def report(milliseconds):
+    """ print percentiles of the (frames, 3) update, draw and swap times and of their sum """
+    columns = ['p{}'.format(p) for p in PERCENTILES] + ['mean', 'max']
+    print('{:>8}'.format('ms') + ''.join('{:>9}'.format(column) for column in columns))
+
+    phases = np.column_stack((milliseconds, milliseconds.sum(axis=1)))
+    for name, times in zip(('update', 'draw', 'swap', 'frame'), phases.T):
+        values = list(np.percentile(times, PERCENTILES)) + [times.mean(), times.max()]
+        print('{:>8}'.format(name) + ''.join('{:9.2f}'.format(value) for value in values))
+
+
+def report_profile(summary):
+    """ print the profiler summary, most expensive scopes first """
+    print('{:>24}{:>9}{:>9}{:>9}'.format('ms per frame', 'calls', 'cpu', 'gpu'))
+    for name, (calls, cpu, gpu) in sorted(summary.items(), key=lambda item: -max(item[1][1], item[1][2] or 0)):
+        gpu = '-' if gpu is None else '{:.2f}'.format(gpu)
+        print('{:>24}{:9.1f}{:9.2f}{:>9}'.format(name, calls, cpu, gpu))
+
+
+if __name__ == '__main__':
+    main()
+    glfw.terminate()
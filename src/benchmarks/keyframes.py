@@ -0,0 +1,60 @@
+#!/usr/bin/env python3
+""" Update time per animated node on the officer keyframes: nodes evaluating
+    their keys, nodes looking up the baked table one by one, and the same
+    nodes under a KeyFrameGroup looking it up in one batch
+
+    $ cd src/
+    $ python3 -m benchmarks.keyframes
+"""
+
+from timeit import repeat
+
+import numpy as np
+
+from core.keyframes import TransformKeyFrames, KeyFrameControlNode, KeyFrameGroup
+from officer import OFFICER_TRANSLATE, OFFICER_ROTATE, OFFICER_SCALE, OFFICER_PERIOD, OFFICER_BAKE_RATE
+
+
+NB_NODES = (1, 10, 100, 1000)
+REPEAT = 3
+DELTA_TIME = 1 / 60
+
+
+def nodes(times, bake_rate=None):
+    return [KeyFrameControlNode(OFFICER_TRANSLATE, OFFICER_ROTATE, OFFICER_SCALE, OFFICER_PERIOD,
+                                bake_rate=bake_rate, time=time) for time in times]
+
+
+def microseconds_per_node(update, nb_nodes):
+    number = max(1, 20000 // nb_nodes)
+    return 1e6 * min(repeat(lambda: update(DELTA_TIME), number=number, repeat=REPEAT)) / number / nb_nodes
+
+
+def main():
+    keyframes = TransformKeyFrames(OFFICER_TRANSLATE, OFFICER_ROTATE, OFFICER_SCALE)
+    baked = keyframes.bake(OFFICER_PERIOD, OFFICER_BAKE_RATE)
+
+    times = np.random.default_rng(0).uniform(0, OFFICER_PERIOD, max(NB_NODES))
+    error = np.max(np.abs(baked.values(times) - keyframes.values(times)))
+    print('baked at {} Hz, {} frames, max error {:.1e}'.format(OFFICER_BAKE_RATE, len(baked.frames), error))
+
+    # the group sets the same transforms as its nodes updated one by one
+    one_by_one, group = nodes(times[:10], OFFICER_BAKE_RATE), KeyFrameGroup(nodes(times[:10], OFFICER_BAKE_RATE))
+    for node in one_by_one:
+        node.update(DELTA_TIME)
+    group.update(DELTA_TIME)
+    assert all(np.allclose(a.transform, b.transform) for a, b in zip(one_by_one, group.children))
+
+    print('{:>6} {:>12} {:>12} {:>12}'.format('nodes', 'keys (us)', 'baked (us)', 'group (us)'))
+    for nb_nodes in NB_NODES:
+        samples = times[:nb_nodes]
+        keyed, baked_nodes = nodes(samples), nodes(samples, OFFICER_BAKE_RATE)
+        print('{:6d} {:12.2f} {:12.2f} {:12.2f}'.format(
+            nb_nodes,
+            microseconds_per_node(lambda delta_time: [node.update(delta_time) for node in keyed], nb_nodes),
+            microseconds_per_node(lambda delta_time: [node.update(delta_time) for node in baked_nodes], nb_nodes),
+            microseconds_per_node(KeyFrameGroup(nodes(samples, OFFICER_BAKE_RATE)).update, nb_nodes)))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,90 @@
+#!/usr/bin/env python3
+""" Time per call of the scalar fast paths of core.transform versus the
+    former NumPy constructions, after checking that both agree
+
+    $ cd src/
+    $ python3 -m benchmarks.transforms
+"""
+
+import math
+from timeit import repeat
+
+import numpy as np
+
+from core.transform import (vec, translate, scale, rotate, lookat, quaternion_from_axis_angle,
+                            quaternion_matrix, compose_trs, affine_inverse)
+
+
+NUMBER = 20000
+REPEAT = 3
+
+
+def normalized_reference(vector):
+    norm = math.sqrt(sum(vector*vector))
+    return vector / norm if norm > 0. else vector
+
+
+def rotate_reference(axis=(1., 0., 0.), angle=0.0):
+    """ former rotation matrix, kept as a reference """
+    x, y, z = normalized_reference(vec(axis))
+    s, c = math.sin(math.radians(angle)), math.cos(math.radians(angle))
+    nc = 1 - c
+    return np.array([[x*x*nc + c,   x*y*nc - z*s, x*z*nc + y*s, 0],
+                     [y*x*nc + z*s, y*y*nc + c,   y*z*nc - x*s, 0],
+                     [x*z*nc - y*s, y*z*nc + x*s, z*z*nc + c,   0],
+                     [0,            0,            0,            1]], 'f')
+
+
+def lookat_reference(eye, target, up):
+    """ former view matrix, kept as a reference """
+    view = normalized_reference(vec(target)[:3] - vec(eye)[:3])
+    up = normalized_reference(vec(up)[:3])
+    right = np.cross(view, up)
+    up = np.cross(right, view)
+    rotation = np.identity(4)
+    rotation[:3, :3] = np.vstack([right, up, -view])
+    return rotation @ translate(-eye)
+
+
+def quaternion_matrix_reference(q):
+    """ former quaternion matrix, kept as a reference """
+    q = normalized_reference(q)
+    nxx, nyy, nzz = -q[1]*q[1], -q[2]*q[2], -q[3]*q[3]
+    qwx, qwy, qwz = q[0]*q[1], q[0]*q[2], q[0]*q[3]
+    qxy, qxz, qyz = q[1]*q[2], q[1]*q[3], q[2]*q[3]
+    return np.array([[2*(nyy + nzz)+1, 2*(qxy - qwz),   2*(qxz + qwy),   0],
+                     [2 * (qxy + qwz), 2 * (nxx + nzz) + 1, 2 * (qyz - qwx), 0],
+                     [2 * (qxz - qwy), 2 * (qyz + qwx), 2 * (nxx + nyy) + 1, 0],
+                     [0, 0, 0, 1]], 'f')
+
+
+def trs_reference(translation, rotation, scaling):
+    return translate(translation) @ quaternion_matrix_reference(rotation) @ scale(scaling)
+
+
+def microseconds(function, *args):
+    return 1e6 * min(repeat(lambda: function(*args), number=NUMBER, repeat=REPEAT)) / NUMBER
+
+
+def main():
+    eye, target, up = vec(3, 4, 12), vec(0, 1, 0), vec(0, 1, 0)
+    q = quaternion_from_axis_angle((1, 2, 0), 40)
+    translation, scaling = vec(0, 23.15, 14), 1.5
+    matrix = compose_trs(translation, q, scaling)
+    out = np.empty((4, 4), np.float32)
+
+    cases = [('rotate', (rotate_reference, (0, 1, 0), 30), (rotate, (0, 1, 0), 30, None, out)),
+             ('lookat', (lookat_reference, eye, target, up), (lookat, eye, target, up, out)),
+             ('quaternion_matrix', (quaternion_matrix_reference, q), (quaternion_matrix, q, out)),
+             ('compose_trs', (trs_reference, translation, q, scaling), (compose_trs, translation, q, scaling, out)),
+             ('affine_inverse', (np.linalg.inv, matrix), (affine_inverse, matrix, out))]
+
+    print('{:>18} {:>12} {:>12} {:>8}'.format('', 'before (us)', 'after (us)', 'speedup'))
+    for name, (reference, *reference_args), (function, *args) in cases:
+        assert np.allclose(reference(*reference_args), function(*args), atol=1e-5), name
+        before, after = microseconds(reference, *reference_args), microseconds(function, *args)
+        print('{:>18} {:12.2f} {:12.2f} {:7.1f}x'.format(name, before, after, before / after))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,72 @@
+#!/usr/bin/env python3
+""" Accuracy of the cached water heights against direct noise evaluation,
+    time per hull sized query of both once the tiles are cached, and time of
+    a first query while the process pool is still generating its tiles
+
+    $ cd src/
+    $ python3 -m benchmarks.water_heightfield
+"""
+
+from time import perf_counter
+from timeit import repeat
+
+import numpy as np
+
+from water.noise import vec3, noise
+from water.heightfield import HeightfieldCache
+from water.water import POSITION_SCALING_FACTOR, TIME_SCALING_FACTOR
+
+
+NUMBER = 200
+REPEAT = 3
+CHECKED_POINTS = 20000
+EXTENT = 32        # checked positions are in a square of this half size
+DURATION = 30      # and at times up to this
+# in noise units, whose standard deviation is about 0.23, heights being
+# a quarter of it
+TOLERANCE_P99 = 0.025
+TOLERANCE_MAX = 0.05
+HULL_POINTS = 64
+
+
+def direct(xs, zs, time):
+    return noise(vec3(POSITION_SCALING_FACTOR * xs, POSITION_SCALING_FACTOR * zs, TIME_SCALING_FACTOR * time))
+
+
+def microseconds(function, *args):
+    return 1e6 * min(repeat(lambda: function(*args), number=NUMBER, repeat=REPEAT)) / NUMBER
+
+
+def main():
+    cache = HeightfieldCache(POSITION_SCALING_FACTOR, TIME_SCALING_FACTOR)
+
+    # one time per check, the cache interpolating between two slices
+    random = np.random.default_rng(0)
+    errors = []
+    for time in random.uniform(0, DURATION, 5):
+        xs, zs = random.uniform(-EXTENT, EXTENT, (2, CHECKED_POINTS // 5))
+        errors.append(np.abs(cache.heights(xs, zs, time) - direct(xs, zs, time)))
+    errors = np.concatenate(errors)
+    p50, p99, worst = np.percentile(errors, (50, 99, 100))
+    print('error over {} points: p50 {:.4f}, p99 {:.4f}, max {:.4f}'.format(CHECKED_POINTS, p50, p99, worst))
+    assert p99 < TOLERANCE_P99 and worst < TOLERANCE_MAX, (p99, worst)
+
+    # hull sized query, its tiles cached by the first call
+    xs, zs = random.uniform(10, 18, (2, HULL_POINTS))
+    time = 12.3
+    cache.heights(xs, zs, time)
+    before = microseconds(direct, xs, zs, time)
+    after = microseconds(cache.heights, xs, zs, time)
+    print('{} points: direct {:.1f} us, cached {:.1f} us, {:.1f}x'.format(HULL_POINTS, before, after, before / after))
+
+    # first query after a prefetch, answered by direct noise instead of waiting for the pool
+    cache = HeightfieldCache(POSITION_SCALING_FACTOR, TIME_SCALING_FACTOR)
+    cache.prefetch(14, 14, 4, time)
+    start = perf_counter()
+    heights = cache.heights(xs, zs, time)
+    print('first query while prefetching: {:.1f} ms'.format(1000 * (perf_counter() - start)))
+    assert np.allclose(heights, direct(xs, zs, time))
+
+
+if __name__ == '__main__':
+    main()
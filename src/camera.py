@@ -13,7 +13,7 @@ DISTANCE_DEFAULT, DISTANCE_MIN, DISTANCE_MAX = 11, 2, 20
 MOUSE_SENSITIVITY = 180
 SCROLL_SENSITIVITY = 0.5
 FIELD_OF_VIEW = 70
-Z_NEAR, Z_FAR = 0.5, 256
+Z_NEAR, Z_FAR = 0.5, 1024
 
 
 class Camera:
@@ -0,0 +1,310 @@
+#!/usr/bin/env python3
+
+from concurrent.futures import ThreadPoolExecutor
+from math import floor, ceil, hypot
+from time import perf_counter
+
+import numpy as np
+
+from core.node import Node
+from core.profiler import profiler
+from core.transform import translate, frustum_planes, boxes_in_frustum
+from model.model import Model, InstancedModel
+from player import SHIP_NAME, SHIP_MAX_SIZE, HEIGHT_DEFAULT, HEIGHT_WATER_SCALING
+from water.noise import vec3, noise
+
+
+CHUNK_SIZE = 128
+CHUNK_LOAD_DISTANCE = 640     # chunks whose center comes this close to the player are generated
+CHUNK_UNLOAD_DISTANCE = 768   # and released once it is this far, the gap absorbing back and forth
+CHUNK_UPLOAD_BUDGET = 2.0     # milliseconds of GL uploads per frame, at least one chunk being uploaded
+CHUNK_RESCAN_DISTANCE = 32    # player travel before chunk distances are checked again
+CLEAR_DISTANCE = 200          # open water around the start
+
+ISLAND_PROBABILITY = 0.35
+ISLAND_RADII = (16, 40)
+ISLAND_PEAKS = (4, 18)
+ISLAND_BASE = -2              # island edges sink below the lowest waves
+ISLAND_RESOLUTION = 32
+ISLAND_MARGIN = 1.3           # footprint half size, in island radii
+BUOYS_PER_CHUNK = (0, 4)
+SHIPS_PER_CHUNK = (0, 2)
+SHIP_TINTS = (0.4, 0.9)
+
+# (k_a, k_d, k_s, s) in linear RGB, indexed by the material vertex attribute
+SAND, GRASS, ROCK, BUOY_RED, BUOY_WHITE = range(5)
+CHUNK_MATERIALS = [((0.11, 0.09, 0.05), (0.55, 0.45, 0.25), (0.1, 0.1, 0.1), 8.0),
+                   ((0.02, 0.06, 0.01), (0.12, 0.3, 0.06), (0.05, 0.05, 0.05), 8.0),
+                   ((0.05, 0.05, 0.04), (0.25, 0.23, 0.2), (0.1, 0.1, 0.1), 16.0),
+                   ((0.12, 0.01, 0.0), (0.6, 0.03, 0.02), (0.5, 0.5, 0.5), 32.0),
+                   ((0.16, 0.16, 0.16), (0.8, 0.8, 0.8), (0.5, 0.5, 0.5), 32.0)]
+
+# buoy lathe profile as (radius, height, material) rings, bottom to top
+BUOY_PROFILE = [(0.0, -0.6, BUOY_RED), (0.5, -0.6, BUOY_RED), (0.6, 0.0, BUOY_RED), (0.5, 0.5, BUOY_WHITE),
+                (0.3, 1.1, BUOY_WHITE), (0.3, 1.5, BUOY_RED), (0.0, 1.5, BUOY_RED)]
+BUOY_SEGMENTS = 8
+
+
+def generate_chunk(key, seed, chunk_size):
+    """ content of one chunk, the same for the same seed: position, normal,
+        material and index arrays of its islands and buoys relative to the
+        chunk corner, None for open water, and (N, 3) x, z and yaw then
+        (N, 3) tints of its anchored ships in world space """
+    chunk_x, chunk_z = key
+    random = np.random.default_rng([seed, chunk_x & 0xffffffff, chunk_z & 0xffffffff])
+    corner = np.array((chunk_x, chunk_z), float) * chunk_size
+    center = corner + chunk_size / 2
+
+    meshes, obstacles = [], []
+    if random.random() < ISLAND_PROBABILITY and np.linalg.norm(center) > CLEAR_DISTANCE:
+        radius = random.uniform(*ISLAND_RADII)
+        margin = ISLAND_MARGIN * radius
+        island = random.uniform(margin, chunk_size - margin, 2)
+        meshes.append(_island(random, island, radius, random.uniform(*ISLAND_PEAKS)))
+        obstacles.append((island, margin))
+
+    def free_spots(count, clearance):
+        """ count random positions in the chunk away from islands and from each other """
+        spots = []
+        for _ in range(count):
+            spot = random.uniform(clearance, chunk_size - clearance, 2)
+            if all(np.linalg.norm(spot - other) > size + clearance for other, size in obstacles):
+                spots.append(spot)
+                obstacles.append((spot, clearance))
+        return spots
+
+    for spot in free_spots(random.integers(*BUOYS_PER_CHUNK, endpoint=True), 2):
+        meshes.append(_buoy(spot))
+
+    ships = np.array([(*(corner + spot), random.uniform(0, 2 * np.pi)) for spot in
+                      free_spots(random.integers(*SHIPS_PER_CHUNK, endpoint=True), SHIP_MAX_SIZE)]).reshape(-1, 3)
+    tints = random.uniform(*SHIP_TINTS, (len(ships), 3))
+
+    if not meshes:
+        return None, ships, tints
+
+    positions, materials, indices, nb_vertices = [], [], [], 0
+    for position, material, index in meshes:
+        positions.append(position)
+        materials.append(material)
+        indices.append(index + nb_vertices)
+        nb_vertices += len(position)
+    position, index = np.concatenate(positions), np.concatenate(indices)
+    arrays = (position, _vertex_normals(position, index), np.concatenate(materials)[:, np.newaxis], index)
+    return arrays, ships, tints
+
+
+def _island(random, center, radius, peak):
+    """ heightfield dome with a noisy coast and slopes, material by altitude """
+    n = ISLAND_RESOLUTION
+    offsets = random.uniform(-1000, 1000, 3)
+    coordinates = ISLAND_MARGIN * np.linspace(-1, 1, n + 1)
+    x, z = np.meshgrid(coordinates, coordinates)
+
+    distance = np.hypot(x, z) * (1 + 0.3 * noise(vec3(1.5 * x + offsets[0], 1.5 * z + offsets[1], offsets[2])))
+    shape = np.clip(1 - distance * distance, 0, 1) ** 1.5
+    detail = 0.15 * noise(vec3(4 * x + offsets[1], 4 * z + offsets[2], offsets[0]))
+    y = ISLAND_BASE + (peak - ISLAND_BASE) * shape * (1 + detail)
+
+    position = np.column_stack((radius * x.ravel() + center[0], y.ravel(), radius * z.ravel() + center[1]))
+    material = np.where(y < 0.6, SAND, np.where(y < 0.6 * peak, GRASS, ROCK)).ravel()
+    return position.astype(np.float32), material.astype(np.float32), _grid_index(n, n)
+
+
+def _buoy(spot):
+    """ lathe of BUOY_PROFILE floating at spot """
+    angles = np.linspace(0, 2 * np.pi, BUOY_SEGMENTS + 1)
+    radii, heights, materials = (np.array(column, float) for column in zip(*BUOY_PROFILE))
+    position = np.empty((len(BUOY_PROFILE), BUOY_SEGMENTS + 1, 3), np.float32)
+    position[..., 0] = spot[0] + radii[:, np.newaxis] * np.cos(angles)
+    position[..., 1] = HEIGHT_DEFAULT + heights[:, np.newaxis]
+    position[..., 2] = spot[1] + radii[:, np.newaxis] * np.sin(angles)
+    material = np.repeat(materials, BUOY_SEGMENTS + 1).astype(np.float32)
+    return position.reshape(-1, 3), material, _grid_index(BUOY_SEGMENTS, len(BUOY_PROFILE) - 1)
+
+
+def _grid_index(width, depth):
+    """ triangles of a grid of (depth + 1) rows of (width + 1) vertices, facing up for rows along +z """
+    corners = (np.arange(depth)[:, np.newaxis] * (width + 1) + np.arange(width)).ravel()
+    quad = np.array((0, width + 1, 1, 1, width + 1, width + 2))
+    return (corners[:, np.newaxis] + quad).ravel().astype(np.uint32)
+
+
+def _vertex_normals(position, index):
+    """ area weighted average of the normals of the triangles around each vertex """
+    triangles = position[index.reshape(-1, 3)].astype(float)
+    faces = np.cross(triangles[:, 1] - triangles[:, 0], triangles[:, 2] - triangles[:, 0])
+    normals = np.zeros((len(position), 3))
+    for corner in range(3):
+        np.add.at(normals, index[corner::3], faces)
+    lengths = np.linalg.norm(normals, axis=1, keepdims=True)
+    return (normals / np.maximum(lengths, 1e-12)).astype(np.float32)
+
+
+class ChunkManager(Node):
+    """ Endless procedural world around the player, in square chunks of
+        islands, buoys and anchored ships generated by a worker thread. Chunks
+        load and unload at two distances, so that sailing along a border does
+        not churn them, and their meshes reach the GPU within a per frame time
+        budget so that crossing borders does not stall frames """
+    def __init__(self, lights_manager, water, player, seed=0, chunk_size=CHUNK_SIZE,
+                    load_distance=CHUNK_LOAD_DISTANCE, unload_distance=CHUNK_UNLOAD_DISTANCE,
+                    upload_budget=CHUNK_UPLOAD_BUDGET):
+        super().__init__()
+        assert unload_distance > load_distance, 'chunks would unload as soon as loaded'
+
+        self.lights_manager = lights_manager
+        self.water = water
+        self.player = player
+        self.seed = seed
+        self.chunk_size = chunk_size
+        self.load_distance, self.unload_distance = load_distance, unload_distance
+        self.upload_budget = upload_budget
+
+        self.chunks = {}   # key to (node, ships, tints) of the loaded chunks
+        self.pending = {}  # key to future of the chunks being generated
+        self.ready = {}    # key to generated content waiting for upload
+        self.executor = ThreadPoolExecutor(max_workers=1)
+        self.scan_position = None  # player (x, z) when chunk distances were last checked
+
+        self.ships = InstancedModel(SHIP_NAME, lights_manager)
+        self.add(self.ships)
+        lowers, uppers = zip(*[child.bounds for child in self.ships.children])
+        lower, upper = np.min(lowers, axis=0), np.max(uppers, axis=0)
+        self.ship_scaling = SHIP_MAX_SIZE / np.max(upper - lower)
+        self.ship_center = self.ship_scaling * (lower + upper) / 2
+        self._gather()
+
+        self.stats = {'chunks': 0, 'visible': 0, 'pending': 0, 'uploads': 0}
+
+    def update(self, delta_time):
+        x, _, z = self.player.position
+        self._stream(x, z)
+        with profiler.scope('chunk uploads', gpu=False):
+            self._upload(x, z)
+        self._anchor_ships()
+
+        # chunk content is static, children are not updated
+        self.stats.update(chunks=len(self.chunks), pending=len(self.pending) + len(self.ready))
+
+    def _distance(self, key, x, z):
+        """ distance from (x, z) to the center of chunk key """
+        return hypot((key[0] + 0.5) * self.chunk_size - x, (key[1] + 0.5) * self.chunk_size - z)
+
+    def _stream(self, x, z):
+        """ collect generated chunks, and once the player travelled far enough
+            since the last check, queue the chunks within load distance nearest
+            first and drop those beyond unload distance """
+        for key in [key for key, future in self.pending.items() if future.done()]:
+            self.ready[key] = self.pending.pop(key).result()
+
+        if self.scan_position is not None and hypot(x - self.scan_position[0],
+                                                    z - self.scan_position[1]) < CHUNK_RESCAN_DISTANCE:
+            return
+        self.scan_position = (x, z)
+
+        for chunks in (self.pending, self.ready):
+            for key in [key for key in chunks if self._distance(key, x, z) > self.unload_distance]:
+                if chunks is self.pending:
+                    chunks[key].cancel()
+                del chunks[key]
+        far = [key for key in self.chunks if self._distance(key, x, z) > self.unload_distance]
+        if far:
+            for key in far:
+                self.children.remove(self.chunks.pop(key)[0])
+            self._gather()
+
+        size = self.chunk_size
+        reach_x = range(floor((x - self.load_distance) / size), ceil((x + self.load_distance) / size))
+        reach_z = range(floor((z - self.load_distance) / size), ceil((z + self.load_distance) / size))
+        wanted = [key for key in ((chunk_x, chunk_z) for chunk_z in reach_z for chunk_x in reach_x)
+                    if key not in self.chunks and key not in self.pending and key not in self.ready
+                    and self._distance(key, x, z) <= self.load_distance]
+        for key in sorted(wanted, key=lambda key: self._distance(key, x, z)):
+            self.pending[key] = self.executor.submit(generate_chunk, key, self.seed, size)
+
+    def _upload(self, x, z):
+        """ turn generated chunks into scene nodes, nearest first, until the frame's budget is spent """
+        start, uploads = perf_counter(), 0
+        for key in sorted(self.ready, key=lambda key: self._distance(key, x, z)):
+            if uploads and 1000 * (perf_counter() - start) > self.upload_budget:
+                break
+            arrays, ships, tints = self.ready.pop(key)
+            node = Node(transform=translate(key[0] * self.chunk_size, 0, key[1] * self.chunk_size))
+            if arrays is not None:
+                position, normal, material, index = arrays
+                node.add(Model(self.lights_manager, [position, normal, material], index,
+                                materials=CHUNK_MATERIALS))
+            self.chunks[key] = (node, ships, tints)
+            self.add(node)
+            uploads += 1
+
+        if uploads:
+            self._gather()
+        self.stats['uploads'] = uploads
+
+    def queue(self, render_queue, projection, view, model, camera):
+        model = self.world_matrix(model)
+        children = self._visible(projection @ view @ model)
+        self.stats['visible'] = len(children) - 1
+        for child in children:
+            child.queue(render_queue, projection, view, model, camera)
+
+    def draw(self, projection, view, model, camera):
+        model = self.world_matrix(model)
+        children = self._visible(projection @ view @ model)
+        self.stats['visible'] = len(children) - 1
+        for child in children:
+            with profiler.scope(type(child).__name__):
+                child.draw(projection, view, model, camera)
+
+    def draw_shadow(self, shadow_caster, model):
+        model = self.world_matrix(model)
+        for child in self._visible(shadow_caster.viewproj @ model):
+            if child.casts_shadow:
+                child.draw_shadow(shadow_caster, model)
+
+    def shadow_key(self, model, shadow_viewproj):
+        model = self.world_matrix(model)
+        return tuple(child.shadow_key(model, shadow_viewproj) for child in self._visible(shadow_viewproj @ model)
+                        if child.casts_shadow)
+
+    def _visible(self, viewproj):
+        """ the ships, then the chunk meshes whose bounds touch the frustum of viewproj """
+        visible = boxes_in_frustum(frustum_planes(viewproj), self.lower, self.upper)
+        return [self.ships] + [node for node, shown in zip(self.meshes, visible) if shown]
+
+    def _gather(self):
+        """ chunk mesh bounds and static part of the ship transforms, rebuilt when chunks come and go """
+        self.meshes = [node for node, _, _ in self.chunks.values() if node.children]
+        bounds = np.array([node.transform[:3, 3] + node.children[0].bounds for node in self.meshes]).reshape(-1, 2, 3)
+        self.lower, self.upper = bounds[:, 0], bounds[:, 1]
+
+        chunks = list(self.chunks.values())
+        ships = np.concatenate([ships for _, ships, _ in chunks] + [np.empty((0, 3))])
+        self.ship_tints = np.concatenate([tints for _, _, tints in chunks] + [np.empty((0, 3))])
+        sines, cosines = np.sin(ships[:, 2]), np.cos(ships[:, 2])
+        rotations = np.zeros((len(ships), 3, 3))
+        rotations[:, 0, 0], rotations[:, 0, 2] = cosines, sines
+        rotations[:, 1, 1] = 1
+        rotations[:, 2, 0], rotations[:, 2, 2] = -sines, cosines
+
+        self.ship_transforms = np.zeros((len(ships), 4, 4), np.float32)
+        self.ship_transforms[:, :3, :3] = self.ship_scaling * rotations
+        # rotation about the model center in x and z, the keel at the water height set every frame
+        pivots = rotations @ self.ship_center
+        self.ship_transforms[:, 0, 3] = ships[:, 0] - pivots[:, 0]
+        self.ship_transforms[:, 2, 3] = ships[:, 1] - pivots[:, 2]
+        self.ship_transforms[:, 3, 3] = 1
+        self.ship_positions = ships[:, :2]
+
+    def _anchor_ships(self):
+        """ ride the anchored ships on the waves """
+        if len(self.ship_positions):
+            heights = HEIGHT_DEFAULT + HEIGHT_WATER_SCALING * self.water.heights(
+                            self.ship_positions[:, 0], self.ship_positions[:, 1], cached=False)
+            self.ship_transforms[:, 1, 3] = heights
+        self.ships.set_instances(self.ship_transforms, self.ship_tints)
+
+    def __del__(self):
+        self.executor.shutdown(wait=False, cancel_futures=True)
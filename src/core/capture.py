@@ -0,0 +1,100 @@
+#!/usr/bin/env python3
+
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+import ctypes
+import os
+
+import OpenGL.GL as GL
+import numpy as np
+from PIL import Image
+
+from core.gl_state import gl_state
+
+
+CAPTURE_RING_SIZE = 3      # frames between reading pixels and mapping them
+CAPTURE_MAX_PENDING = 16   # frames waiting for the encoder before capture waits for it
+RAW_EXTENSIONS = ('.rgb', '.raw')
+PNG_COMPRESS_LEVEL = 1     # fast compression, recordings favour frame rate over size
+
+
+class FrameRecorder:
+    """ Frames of the current framebuffer read into a ring of pixel buffer
+        objects and mapped a few frames later, once the GPU is done with them,
+        then encoded by a background thread. A path ending in .rgb or .raw is
+        a raw RGB24 stream, for instance for
+            ffmpeg -f rawvideo -pix_fmt rgb24 -s WxH -r 60 -i frames.rgb out.mp4
+        any other path a directory of numbered PNG images """
+    def __init__(self, path, size, ring_size=CAPTURE_RING_SIZE):
+        self.path = path
+        self.size = tuple(size)
+        self.nbytes = 4 * self.size[0] * self.size[1]
+
+        self.raw = os.path.splitext(path)[1].lower() in RAW_EXTENSIONS
+        if self.raw:
+            self.stream = open(path, 'wb')
+        else:
+            os.makedirs(path, exist_ok=True)
+
+        self.buffers = [GL.glGenBuffers(1) for _ in range(ring_size)]
+        for buffer in self.buffers:
+            GL.glBindBuffer(GL.GL_PIXEL_PACK_BUFFER, buffer)
+            GL.glBufferData(GL.GL_PIXEL_PACK_BUFFER, self.nbytes, None, GL.GL_STREAM_READ)
+        GL.glBindBuffer(GL.GL_PIXEL_PACK_BUFFER, 0)
+
+        self.in_flight = deque()  # (frame number, buffer) read but not mapped yet
+        self.nb_frames = 0
+
+        # a single worker writes the frames in order
+        self.encoder = ThreadPoolExecutor(max_workers=1)
+        self.encoding = deque()
+
+    def capture(self):
+        """ read the frame just rendered, and hand the oldest read one to the encoder """
+        if len(self.in_flight) == len(self.buffers):
+            self._map_oldest()
+
+        buffer = self.buffers[self.nb_frames % len(self.buffers)]
+        GL.glBindFramebuffer(GL.GL_READ_FRAMEBUFFER, gl_state.framebuffer)
+        GL.glBindBuffer(GL.GL_PIXEL_PACK_BUFFER, buffer)
+        GL.glReadPixels(0, 0, *self.size, GL.GL_RGBA, GL.GL_UNSIGNED_BYTE, ctypes.c_void_p(0))
+        GL.glBindBuffer(GL.GL_PIXEL_PACK_BUFFER, 0)
+
+        self.in_flight.append((self.nb_frames, buffer))
+        self.nb_frames += 1
+
+    def close(self):
+        """ write the frames still in flight, wait for the encoder and release the buffers """
+        while self.in_flight:
+            self._map_oldest()
+        self.encoder.shutdown(wait=True)
+        self.encoding.clear()
+        if self.raw:
+            self.stream.close()
+        GL.glDeleteBuffers(len(self.buffers), self.buffers)
+        self.buffers = []
+
+    def _map_oldest(self):
+        number, buffer = self.in_flight.popleft()
+        GL.glBindBuffer(GL.GL_PIXEL_PACK_BUFFER, buffer)
+        pointer = GL.glMapBufferRange(GL.GL_PIXEL_PACK_BUFFER, 0, self.nbytes, GL.GL_MAP_READ_BIT)
+        pixels = np.frombuffer((ctypes.c_ubyte * self.nbytes).from_address(pointer), np.uint8).copy()
+        GL.glUnmapBuffer(GL.GL_PIXEL_PACK_BUFFER)
+        GL.glBindBuffer(GL.GL_PIXEL_PACK_BUFFER, 0)
+
+        # a slower encoder bounds memory by making capture wait for it
+        while len(self.encoding) >= CAPTURE_MAX_PENDING:
+            self.encoding.popleft().result()
+        self.encoding.append(self.encoder.submit(self._encode, number, pixels))
+        while self.encoding and self.encoding[0].done():
+            self.encoding.popleft().result()
+
+    def _encode(self, number, pixels):
+        """ write one frame, rows flipped from OpenGL's bottom up order """
+        width, height = self.size
+        rgb = pixels.reshape(height, width, 4)[::-1, :, :3]
+        if self.raw:
+            self.stream.write(np.ascontiguousarray(rgb).tobytes())
+        else:
+            filename = os.path.join(self.path, 'frame_{:06d}.png'.format(number))
+            Image.fromarray(rgb).save(filename, compress_level=PNG_COMPRESS_LEVEL)
@@ -2,6 +2,8 @@
 
 import OpenGL.GL as GL
 
+from core.gl_state import gl_state
+
 
 class Framebuffer:
     """ OpenGL framebuffer with depth attachment """
@@ -9,7 +11,7 @@ class Framebuffer:
         self.glid = GL.glGenFramebuffers(1)
 
         self.texture_glid = GL.glGenTextures(1)
-        GL.glBindTexture(GL.GL_TEXTURE_2D, self.texture_glid)
+        gl_state.bind_texture(0, GL.GL_TEXTURE_2D, self.texture_glid)
         GL.glTexImage2D(GL.GL_TEXTURE_2D, 0, GL.GL_DEPTH_COMPONENT24, width, height,
                         0, GL.GL_DEPTH_COMPONENT, GL.GL_FLOAT, None)
         GL.glTexParameteri(GL.GL_TEXTURE_2D, GL.GL_TEXTURE_WRAP_S, GL.GL_CLAMP_TO_EDGE)
@@ -30,8 +32,49 @@ class Framebuffer:
         if status != GL.GL_FRAMEBUFFER_COMPLETE:
             print('Error: framebuffer is not complete')
 
-        GL.glBindFramebuffer(GL.GL_FRAMEBUFFER, 0)
+        GL.glBindFramebuffer(GL.GL_FRAMEBUFFER, gl_state.framebuffer)
+
+    def __del__(self):
+        GL.glDeleteTextures(self.texture_glid)
+        gl_state.invalidate()
+        GL.glDeleteFramebuffers(1, self.glid)
+
+
+class ColorFramebuffer:
+    """ OpenGL framebuffer with color texture and depth renderbuffer, to
+        render a scene offscreen at a fixed size """
+    def __init__(self, width, height):
+        self.size = (width, height)
+        self.glid = GL.glGenFramebuffers(1)
+
+        self.texture_glid = GL.glGenTextures(1)
+        gl_state.bind_texture(0, GL.GL_TEXTURE_2D, self.texture_glid)
+        GL.glTexImage2D(GL.GL_TEXTURE_2D, 0, GL.GL_RGBA8, width, height,
+                        0, GL.GL_RGBA, GL.GL_UNSIGNED_BYTE, None)
+        GL.glTexParameteri(GL.GL_TEXTURE_2D, GL.GL_TEXTURE_WRAP_S, GL.GL_CLAMP_TO_EDGE)
+        GL.glTexParameteri(GL.GL_TEXTURE_2D, GL.GL_TEXTURE_WRAP_T, GL.GL_CLAMP_TO_EDGE)
+        GL.glTexParameteri(GL.GL_TEXTURE_2D, GL.GL_TEXTURE_MAG_FILTER, GL.GL_LINEAR)
+        GL.glTexParameteri(GL.GL_TEXTURE_2D, GL.GL_TEXTURE_MIN_FILTER, GL.GL_LINEAR)
+
+        self.depth_glid = GL.glGenRenderbuffers(1)
+        GL.glBindRenderbuffer(GL.GL_RENDERBUFFER, self.depth_glid)
+        GL.glRenderbufferStorage(GL.GL_RENDERBUFFER, GL.GL_DEPTH_COMPONENT24, width, height)
+        GL.glBindRenderbuffer(GL.GL_RENDERBUFFER, 0)
+
+        GL.glBindFramebuffer(GL.GL_FRAMEBUFFER, self.glid)
+        GL.glFramebufferTexture2D(GL.GL_FRAMEBUFFER, GL.GL_COLOR_ATTACHMENT0,
+                                    GL.GL_TEXTURE_2D, self.texture_glid, 0)
+        GL.glFramebufferRenderbuffer(GL.GL_FRAMEBUFFER, GL.GL_DEPTH_ATTACHMENT,
+                                        GL.GL_RENDERBUFFER, self.depth_glid)
+
+        status = GL.glCheckFramebufferStatus(GL.GL_FRAMEBUFFER)
+        if status != GL.GL_FRAMEBUFFER_COMPLETE:
+            print('Error: framebuffer is not complete')
+
+        GL.glBindFramebuffer(GL.GL_FRAMEBUFFER, gl_state.framebuffer)
 
     def __del__(self):
         GL.glDeleteTextures(self.texture_glid)
+        GL.glDeleteRenderbuffers(1, [self.depth_glid])
+        gl_state.invalidate()
         GL.glDeleteFramebuffers(1, self.glid)
@@ -0,0 +1,63 @@
+#!/usr/bin/env python3
+
+import OpenGL.GL as GL
+
+
+class GLState:
+    """ Shadow copy of the bound program, vertex array and textures, and of the
+        material last uploaded to each program, to skip redundant binds and
+        uploads and count the ones actually issued during a frame, along with
+        draw calls """
+    def __init__(self):
+        self.stats = {'program_binds': 0, 'vertex_array_binds': 0, 'texture_binds': 0, 'material_uploads': 0,
+                        'draw_calls': 0}
+        self.framebuffer = 0  # target of the main pass, for passes rendering elsewhere to restore
+        self.invalidate()
+
+    def invalidate(self):
+        """ forget the bindings, after GL objects were deleted or bound behind our back """
+        self.program = None
+        self.vertex_array = None
+        self.texture_unit = None
+        self.textures = {}
+        self.materials = {}  # program to the material its uniforms hold
+
+    def new_frame(self):
+        """ start counting binds for a new frame """
+        self.invalidate()
+        for name in self.stats:
+            self.stats[name] = 0
+
+    def use_program(self, glid):
+        if glid != self.program:
+            GL.glUseProgram(glid)
+            self.program = glid
+            self.stats['program_binds'] += 1
+
+    def bind_vertex_array(self, glid):
+        if glid != self.vertex_array:
+            GL.glBindVertexArray(glid)
+            self.vertex_array = glid
+            self.stats['vertex_array_binds'] += 1
+
+    def set_material(self, material):
+        """ record material as uploaded to the bound program, returning
+            False when the program already holds it and the upload can be skipped """
+        if self.materials.get(self.program) == material:
+            return False
+        self.materials[self.program] = material
+        self.stats['material_uploads'] += 1
+        return True
+
+    def bind_texture(self, texture_unit, target, glid):
+        if self.textures.get((texture_unit, target)) == glid:
+            return
+        if texture_unit != self.texture_unit:
+            GL.glActiveTexture(GL.GL_TEXTURE0 + texture_unit)
+            self.texture_unit = texture_unit
+        GL.glBindTexture(target, glid)
+        self.textures[texture_unit, target] = glid
+        self.stats['texture_binds'] += 1
+
+
+gl_state = GLState()
@@ -4,8 +4,11 @@
 # code from: http://morpheo.inrialpes.fr/~franco/3dgraphics/
 
 from bisect import bisect_left
+import math
 
-from core.transform import lerp, quaternion_slerp, translate, quaternion_matrix, scale
+import numpy as np
+
+from core.transform import lerp, quaternion_slerp, compose_trs
 from core.node import Node
 
 
@@ -48,23 +51,90 @@ class TransformKeyFrames:
 
     def value(self, time):
         """ Compute each component's interpolation and compose TRS matrix """
-        translation = translate(self.translate_keyframes.value(time))
-        rotation = quaternion_matrix(self.rotate_keyframes.value(time))
-        scaling = scale(self.scale_keyframes.value(time))
+        return compose_trs(self.translate_keyframes.value(time),
+                            self.rotate_keyframes.value(time),
+                            self.scale_keyframes.value(time))
+
+    def values(self, times):
+        """ (N, 4, 4) matrices for N times """
+        return np.array([self.value(time) for time in times], 'f')
+
+    def bake(self, period, rate):
+        """ BakedTransformKeyFrames sampling [0, period] rate times per second """
+        nb_frames = math.ceil(period * rate)
+        return BakedTransformKeyFrames(self.values(np.arange(nb_frames + 1) / rate), rate)
+
+
+class BakedTransformKeyFrames:
+    """ Transform keyframes sampled at a fixed rate into a (frames, 4, 4)
+        matrix table, played back by lookup and linear interpolation """
+    def __init__(self, frames, rate):
+        self.frames = np.ascontiguousarray(frames, 'f')
+        self.rate = rate
+
+    def value(self, time):
+        index = min(max(time * self.rate, 0.0), len(self.frames) - 1.0)
+        frame = min(int(index), len(self.frames) - 2)
+        before = self.frames[frame]
+        return before + (index - frame) * (self.frames[frame + 1] - before)
 
-        return translation @ rotation @ scaling
+    def values(self, times):
+        """ (N, 4, 4) matrices for N times, in a few array operations """
+        index = np.clip(np.asarray(times, dtype=float) * self.rate, 0.0, len(self.frames) - 1.0)
+        frame = np.minimum(index.astype(int), len(self.frames) - 2)
+        before = self.frames[frame]
+        fraction = (index - frame).astype('f')[:, np.newaxis, np.newaxis]
+        return before + fraction * (self.frames[frame + 1] - before)
+
+
+# baked tables shared by every node animated by the same keys
+_baked_keyframes = {}
+
+def baked_keyframes(translate_keys, rotate_keys, scale_keys, period, rate):
+    """ BakedTransformKeyFrames of the keys, baked once per set of key objects """
+    key = (id(translate_keys), id(rotate_keys), id(scale_keys), period, rate)
+    if key not in _baked_keyframes:
+        baked = TransformKeyFrames(translate_keys, rotate_keys, scale_keys).bake(period, rate)
+        # keep the keys alive, so that their ids are not reused
+        _baked_keyframes[key] = (translate_keys, rotate_keys, scale_keys, baked)
+    return _baked_keyframes[key][3]
 
 
 class KeyFrameControlNode(Node):
-    """ Place node with transform keys above a controlled subtree """
-    def __init__(self, translate_keys, rotate_keys, scale_keys, period):
+    """ Place node with transform keys above a controlled subtree, keys
+        being baked bake_rate times per second when given """
+    def __init__(self, translate_keys, rotate_keys, scale_keys, period, bake_rate=None, time=0):
         super().__init__()
-        self.keyframes = TransformKeyFrames(translate_keys, rotate_keys, scale_keys)
+        if bake_rate:
+            self.keyframes = baked_keyframes(translate_keys, rotate_keys, scale_keys, period, bake_rate)
+        else:
+            self.keyframes = TransformKeyFrames(translate_keys, rotate_keys, scale_keys)
         self.period = period
-        self.time = 0
+        self.time = time % period
 
     def update(self, delta_time):
         """ When update requested, interpolate our node transform from keys """
         self.time = (self.time + delta_time) % self.period
         self.set_transform(self.keyframes.value(self.time))
         super().update(delta_time)
+
+
+class KeyFrameGroup(Node):
+    """ Parent of many KeyFrameControlNode, evaluating all the nodes sharing
+        keyframes in one batch instead of one by one """
+    def update(self, delta_time):
+        batches = {}
+        for child in self.children:
+            if isinstance(child, KeyFrameControlNode):
+                child.time = (child.time + delta_time) % child.period
+                batches.setdefault(id(child.keyframes), []).append(child)
+            elif hasattr(child, 'update'):
+                child.update(delta_time)
+
+        for nodes in batches.values():
+            keyframes, times = nodes[0].keyframes, [node.time for node in nodes]
+            # a lone node is faster to evaluate on its own than as an array of one
+            matrices = keyframes.values(times) if len(nodes) > 1 else [keyframes.value(times[0])]
+            for node, matrix in zip(nodes, matrices):
+                node.set_transform(matrix)
+                Node.update(node, delta_time)  # subtree only, the node itself is up to date
@@ -2,26 +2,41 @@
 
 import OpenGL.GL as GL
 
+from core.gl_state import gl_state
 from core.vertex_array import VertexArray
 
 
 class Mesh:
     """ Mesh to refactor all previous classes """
+    nb_instances = None  # copies drawn in one instanced call, None for a plain draw
+
     def __init__(self, shader, attributes, index=None):
         self.shader = shader
         names = ['view', 'projection', 'model']
         self.locations = {name: GL.glGetUniformLocation(shader.glid, name) for name in names}
         self.vertex_array = VertexArray(attributes, index)
+        self.casts_shadow = True
+        self.material = ()  # sort key of the state set by draw besides the program
 
     def add_locations(self, *names):
         locations = {name: GL.glGetUniformLocation(self.shader.glid, name) for name in names}
         self.locations.update(locations)
 
-    def draw(self, projection, view, model, normal_matrix, camera):
-        GL.glUseProgram(self.shader.glid)
+    def draw(self, projection, view, model, camera):
+        gl_state.use_program(self.shader.glid)
 
         GL.glUniformMatrix4fv(self.locations['view'], 1, True, view)
         GL.glUniformMatrix4fv(self.locations['projection'], 1, True, projection)
         GL.glUniformMatrix4fv(self.locations['model'], 1, True, model)
 
-        self.vertex_array.execute(GL.GL_TRIANGLES)
+        self.vertex_array.execute(GL.GL_TRIANGLES, self.nb_instances)
+
+    def queue(self, render_queue, projection, view, model, camera):
+        render_queue.add(lambda: self.draw(projection, view, model, camera),
+                            self.shader.glid, self.material, model[:3, 3], name=type(self).__name__)
+
+    def shadow_key(self, model, shadow_viewproj):
+        return model.tobytes()
+
+    def draw_shadow(self, shadow_caster, model):
+        shadow_caster.draw(self.vertex_array, model, self.nb_instances)
@@ -1,19 +1,31 @@
 #!/usr/bin/env python3
 
-import numpy as np
-
+from core.profiler import profiler
 from core.transform import identity
 
 
 class Node:
     """ Scene graph transform and parameter broadcast node """
     def __init__(self, children=(), transform=identity()):
+        self.world, self.parent_model = None, None
         self.set_transform(transform)
         self.children = list(iter(children))
+        self.casts_shadow = True
 
     def set_transform(self, transform):
         self.transform = transform
-        self.normal_matrix = np.linalg.inv(self.transform).T
+        self.dirty = True
+
+    def world_matrix(self, model):
+        """ model @ transform, recomputed only when the transform or the parent
+            matrix changed. A recomputed matrix is a new object, so checking the
+            parent matrix identity propagates changes down the tree, while
+            unchanged subtrees reuse their matrices in every pass """
+        if self.dirty or model is not self.parent_model:
+            self.world = model @ self.transform
+            self.parent_model = model
+            self.dirty = False
+        return self.world
 
     def add(self, *drawables):
         """ Add drawables to this node, simply updating children list """
@@ -23,13 +35,39 @@ class Node:
         """ Recursive update """
         for child in self.children:
             if hasattr(child, 'update'):
-                child.update(delta_time)
+                with profiler.scope(type(child).__name__, gpu=False):
+                    child.update(delta_time)
 
-    def draw(self, projection, view, model, normal_matrix, camera):
+    def draw(self, projection, view, model, camera):
         """ Recursive draw """
+        model = self.world_matrix(model)
         for child in self.children:
             if hasattr(child, 'draw'):
-                child.draw(projection, view, model @ self.transform, normal_matrix @ self.normal_matrix, camera)
+                with profiler.scope(type(child).__name__):
+                    child.draw(projection, view, model, camera)
+
+    def queue(self, render_queue, projection, view, model, camera):
+        """ Recursive collection of draw items, children unable to queue are drawn right away """
+        model = self.world_matrix(model)
+        for child in self.children:
+            if hasattr(child, 'queue'):
+                child.queue(render_queue, projection, view, model, camera)
+            elif hasattr(child, 'draw'):
+                child.draw(projection, view, model, camera)
+
+    def draw_shadow(self, shadow_caster, model):
+        """ Recursive depth only draw of the shadow casting children """
+        model = self.world_matrix(model)
+        for child in self.children:
+            if hasattr(child, 'draw_shadow') and child.casts_shadow:
+                child.draw_shadow(shadow_caster, model)
+
+    def shadow_key(self, model, shadow_viewproj):
+        """ what draw_shadow would render seen from shadow_viewproj, equal
+            between two frames when the shadow map would be the same """
+        model = self.world_matrix(model)
+        return tuple(child.shadow_key(model, shadow_viewproj) for child in self.children
+                        if hasattr(child, 'draw_shadow') and child.casts_shadow)
 
     def key_handler(self, key, is_press):
         """ Dispatch keyboard events to children """
@@ -0,0 +1,157 @@
+#!/usr/bin/env python3
+
+from collections import deque
+from contextlib import nullcontext
+import json
+from time import perf_counter
+
+import OpenGL.GL as GL
+import numpy as np
+
+
+PROFILE_HISTORY = 600   # completed frames kept for summaries and traces
+MAX_PENDING_FRAMES = 8  # frames whose GPU timings may be in flight, before reading them waits
+
+
+class Profiler:
+    """ CPU and GPU durations of named scopes, aggregated per frame. GPU
+        durations come from timestamp queries, which unlike GL_TIME_ELAPSED
+        ones nest, and are read back once available a few frames later so
+        that profiling never waits for the GPU """
+    def __init__(self):
+        self.enabled, self.gpu = False, False
+        self.events = None   # [name, cpu start, cpu end, gpu start query, gpu end query] of the current frame
+        self.pending = deque()
+        self.frames = deque(maxlen=PROFILE_HISTORY)
+        self.queries = []    # free query objects
+        self.last_query = None
+        self.frame_number = 0
+        self.origin = perf_counter()
+        self._null = nullcontext()
+
+    def enable(self, gpu=True):
+        self.enabled, self.gpu = True, gpu
+
+    def disable(self):
+        self.enabled = False
+
+    def begin_frame(self):
+        if not self.enabled:
+            return
+        self.events = []
+        self.last_query = None
+        # GPU timestamps are placed on the CPU timeline from a pair read together
+        gpu_clock = np.zeros(1, np.int64)
+        if self.gpu:
+            GL.glGetInteger64v(GL.GL_TIMESTAMP, gpu_clock)
+        self.clock = (perf_counter(), int(gpu_clock[0]))
+
+    def scope(self, name, gpu=True):
+        """ context timing its body as name, also on the GPU unless gpu is False """
+        if self.events is None:
+            return self._null
+        return _Scope(self, name, gpu and self.gpu)
+
+    def end_frame(self):
+        if self.events is None:
+            return
+        self.pending.append((self.frame_number, self.clock, self.events, self.last_query))
+        self.events = None
+        self.frame_number += 1
+        self._collect()
+
+    def summary(self):
+        """ calls, CPU and GPU milliseconds per frame of every scope name, averaged
+            over the completed frames, GPU times being None for CPU only scopes """
+        totals = {}
+        for frame in self.frames:
+            for name, (calls, cpu, gpu) in frame['totals'].items():
+                total = totals.setdefault(name, [0, 0.0, None])
+                total[0] += calls
+                total[1] += cpu
+                if gpu is not None:
+                    total[2] = (total[2] or 0.0) + gpu
+        nb_frames = max(len(self.frames), 1)
+        return {name: (calls / nb_frames, cpu / nb_frames, None if gpu is None else gpu / nb_frames)
+                for name, (calls, cpu, gpu) in totals.items()}
+
+    def export_trace(self, filename):
+        """ write the frames as Chrome trace events, for chrome://tracing or
+            Perfetto, after waiting for the pending ones """
+        self._collect(wait=True)
+        events = [{'name': 'thread_name', 'ph': 'M', 'pid': 1, 'tid': tid, 'args': {'name': name}}
+                  for tid, name in ((1, 'CPU'), (2, 'GPU'))]
+        for frame in self.frames:
+            for name, cpu_start, cpu_duration, gpu_start, gpu_duration in frame['events']:
+                args = {'frame': frame['number']}
+                events.append({'name': name, 'ph': 'X', 'pid': 1, 'tid': 1,
+                               'ts': cpu_start, 'dur': cpu_duration, 'args': args})
+                if gpu_start is not None:
+                    events.append({'name': name, 'ph': 'X', 'pid': 1, 'tid': 2,
+                                   'ts': gpu_start, 'dur': gpu_duration, 'args': args})
+        with open(filename, 'w') as file:
+            json.dump({'traceEvents': events, 'displayTimeUnit': 'ms'}, file)
+
+    def _timestamp(self):
+        query = self.queries.pop() if self.queries else GL.glGenQueries(1)
+        GL.glQueryCounter(query, GL.GL_TIMESTAMP)
+        self.last_query = query
+        return query
+
+    def _collect(self, wait=False):
+        """ read back the oldest frames whose queries completed, in order """
+        available = np.zeros(1, np.int32)
+        while self.pending:
+            number, (cpu_clock, gpu_clock), events, last_query = self.pending[0]
+            if last_query is not None and not wait and len(self.pending) <= MAX_PENDING_FRAMES:
+                GL.glGetQueryObjectiv(last_query, GL.GL_QUERY_RESULT_AVAILABLE, available)
+                if not available[0]:
+                    break
+            self.pending.popleft()
+            self.frames.append(self._frame(number, cpu_clock, gpu_clock, events))
+
+    def _frame(self, number, cpu_clock, gpu_clock, events):
+        """ frame record with events in microseconds since the profiler creation,
+            and per name totals in milliseconds """
+        result = np.zeros(1, np.uint64)
+        frame = {'number': number, 'events': [], 'totals': {}}
+        for name, cpu_start, cpu_end, gpu_start, gpu_end in events:
+            gpu = None
+            if gpu_start is not None:
+                gpu = []
+                for query in (gpu_start, gpu_end):
+                    GL.glGetQueryObjectui64v(query, GL.GL_QUERY_RESULT, result)
+                    gpu.append(1e-3 * (int(result[0]) - gpu_clock) + 1e6 * (cpu_clock - self.origin))
+                    self.queries.append(query)
+                gpu = (gpu[0], gpu[1] - gpu[0])
+            cpu = (1e6 * (cpu_start - self.origin), 1e6 * (cpu_end - cpu_start))
+            frame['events'].append((name, *cpu, *(gpu or (None, None))))
+
+            total = frame['totals'].setdefault(name, [0, 0.0, None])
+            total[0] += 1
+            total[1] += 1e-3 * cpu[1]
+            if gpu is not None:
+                total[2] = (total[2] or 0.0) + 1e-3 * gpu[1]
+        return frame
+
+
+class _Scope:
+    """ timing of one scope occurrence, as a context manager """
+    def __init__(self, profiler, name, gpu):
+        self.profiler = profiler
+        self.event = [name, 0.0, 0.0, None, None]
+        self.gpu = gpu
+
+    def __enter__(self):
+        self.profiler.events.append(self.event)
+        if self.gpu:
+            self.event[3] = self.profiler._timestamp()
+        self.event[1] = perf_counter()
+
+    def __exit__(self, *exception):
+        self.event[2] = perf_counter()
+        if self.gpu:
+            self.event[4] = self.profiler._timestamp()
+
+
+profiler = Profiler()
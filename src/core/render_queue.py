@@ -0,0 +1,44 @@
+#!/usr/bin/env python3
+
+import numpy as np
+
+from core.profiler import profiler
+
+
+# submission groups: opaque geometry first, then the skybox behind it, then overlays
+OPAQUE, BACKGROUND, OVERLAY = range(3)
+
+
+class RenderQueue:
+    """ Draw items collected by a scene traversal, then submitted in one loop
+        sorted by program, material and depth so that consecutive items share
+        their GL state """
+    def __init__(self):
+        self.items = []
+        self.eye = np.zeros(3)
+
+    def begin(self, eye):
+        """ start collecting the items of a frame seen from eye """
+        self.items.clear()
+        self.eye = np.asarray(eye, dtype=float)
+
+    def add(self, draw, program, material=(), position=None, group=OPAQUE, name='draw'):
+        """ queue a draw callable, position being the world point sorting
+            opaque items front to back, and name the one it is profiled as """
+        depth = 0.0
+        if position is not None:
+            depth = float(np.linalg.norm(np.asarray(position, dtype=float)[:3] - self.eye))
+        # the insertion index keeps equal keys in traversal order
+        self.items.append(((group, program, material, depth, len(self.items)), draw, name))
+
+    def flush(self, last_group=None):
+        """ submit and forget the queued items, only those of groups up to
+            last_group when given """
+        self.items.sort(key=lambda item: item[0])
+        count = len(self.items)
+        if last_group is not None:
+            count = next((i for i, item in enumerate(self.items) if item[0][0] > last_group), count)
+        for _, draw, name in self.items[:count]:
+            with profiler.scope(name):
+                draw()
+        del self.items[:count]
@@ -0,0 +1,64 @@
+#!/usr/bin/env python3
+
+import OpenGL.GL as GL
+import numpy as np
+
+from core.framebuffer import ColorFramebuffer
+from core.gl_state import gl_state
+
+
+RESOLUTION_MIN_SCALE = 0.5
+RESOLUTION_SMOOTHING = 0.1  # weight of the last frame in the averaged frame time
+RESOLUTION_TOLERANCE = 0.1  # relative distance to the budget left uncorrected
+RESOLUTION_GAIN = 0.5       # fraction of the estimated correction applied per frame
+
+
+class DynamicResolution:
+    """ Offscreen color and depth target rendered at a fraction of the output
+        size, the fraction adapting every frame for the frame time to stay
+        within budget milliseconds, then upscaled to the output. Fragment
+        work scales with the pixel count, the square of the scale """
+    def __init__(self, size, budget, min_scale=RESOLUTION_MIN_SCALE):
+        self.budget = budget
+        self.min_scale = min_scale
+        self.scale = 1.0
+        self.frame_time = None
+        self.resize(size)
+
+    def resize(self, size):
+        """ output size, the target being allocated at full size once and rendered in part """
+        self.size = tuple(size)
+        self.target = ColorFramebuffer(*self.size)
+
+    def scene_size(self):
+        return tuple(max(1, int(round(self.scale * length))) for length in self.size)
+
+    def adapt(self, frame_time):
+        """ update the scale from the duration in milliseconds of the last frame """
+        if self.frame_time is None:
+            self.frame_time = frame_time
+        self.frame_time += RESOLUTION_SMOOTHING * (frame_time - self.frame_time)
+
+        error = self.frame_time / self.budget
+        if abs(error - 1) > RESOLUTION_TOLERANCE:
+            scale = self.scale * error ** (-0.5 * RESOLUTION_GAIN)
+            self.scale = float(np.clip(scale, self.min_scale, 1.0))
+
+    def begin(self):
+        """ direct the main pass to the target, return its size """
+        size = self.scene_size()
+        gl_state.framebuffer = self.target.glid
+        GL.glBindFramebuffer(GL.GL_FRAMEBUFFER, gl_state.framebuffer)
+        GL.glViewport(0, 0, *size)
+        GL.glClear(GL.GL_COLOR_BUFFER_BIT | GL.GL_DEPTH_BUFFER_BIT)
+        return size
+
+    def end(self, framebuffer):
+        """ upscale the rendered part of the target to framebuffer, and make it current again """
+        GL.glBindFramebuffer(GL.GL_READ_FRAMEBUFFER, self.target.glid)
+        GL.glBindFramebuffer(GL.GL_DRAW_FRAMEBUFFER, framebuffer)
+        GL.glBlitFramebuffer(0, 0, *self.scene_size(), 0, 0, *self.size,
+                                GL.GL_COLOR_BUFFER_BIT, GL.GL_LINEAR)
+        gl_state.framebuffer = framebuffer
+        GL.glBindFramebuffer(GL.GL_FRAMEBUFFER, framebuffer)
+        GL.glViewport(0, 0, *self.size)
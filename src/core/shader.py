@@ -3,13 +3,31 @@
 # MIT License does not apply
 # code from: http://morpheo.inrialpes.fr/~franco/3dgraphics/
 
+import hashlib
 import os
 
 import OpenGL.GL as GL
+import numpy as np
+
+from core.gl_state import gl_state
 
 
 class Shader:
     """ Helper class to create and automatically destroy shader program """
+    programs = {}        # process-wide cache of shared programs, by source key
+    binary_cache = None  # directory of program binaries, when enabled
+
+    @staticmethod
+    def _source(src, defines=None):
+        """ shader source from raw string or file name, with defines after #version """
+        src = open(src, 'r').read() if os.path.exists(src) else src
+        src = src.decode('ascii') if isinstance(src, bytes) else src
+        if defines:
+            lines = ['#define {} {}'.format(name, value) for name, value in sorted(defines.items())]
+            version, _, body = src.partition('\n') if src.startswith('#version') else ('', '', src)
+            src = '\n'.join([version] + lines + [body])
+        return src
+
     @staticmethod
     def _compile_shader(src, shader_type):
         src = open(src, 'r').read() if os.path.exists(src) else src
@@ -27,15 +45,58 @@ class Shader:
             return None
         return shader
 
-    def __init__(self, vertex_source, fragment_source):
+    @classmethod
+    def cached(cls, vertex_source, fragment_source, defines=None):
+        """ Shader shared by every caller with the same sources and defines,
+            compiled on first request only """
+        vertex_source = cls._source(vertex_source, defines)
+        fragment_source = cls._source(fragment_source, defines)
+        key = cls._key(vertex_source, fragment_source)
+        if key not in cls.programs:
+            cls.programs[key] = cls(vertex_source, fragment_source)
+        return cls.programs[key]
+
+    @classmethod
+    def clear_cache(cls):
+        """ release shared programs, to call while the GL context is still alive """
+        cls.programs.clear()
+
+    @classmethod
+    def set_binary_cache(cls, directory):
+        """ save linked programs in directory and reload them on later runs,
+            when the driver supports program binaries """
+        if GL.glGetIntegerv(GL.GL_NUM_PROGRAM_BINARY_FORMATS) > 0:
+            os.makedirs(directory, exist_ok=True)
+            cls.binary_cache = directory
+
+    @staticmethod
+    def _key(vertex_source, fragment_source):
+        return hashlib.sha1('\0'.join((vertex_source, fragment_source)).encode()).hexdigest()
+
+    def __init__(self, vertex_source, fragment_source, defines=None):
         """ Shader can be initialized with raw strings or source file names """
         self.glid = None
+        vertex_source = self._source(vertex_source, defines)
+        fragment_source = self._source(fragment_source, defines)
+
+        binary_name = None
+        if self.binary_cache:
+            # binaries only load on the driver that produced them
+            driver = b'\0'.join(GL.glGetString(name) for name in (GL.GL_VENDOR, GL.GL_RENDERER, GL.GL_VERSION))
+            key = self._key(vertex_source, fragment_source + driver.decode('ascii', 'replace'))
+            binary_name = os.path.join(self.binary_cache, key + '.bin')
+            self.glid = self._load_binary(binary_name)
+            if self.glid:
+                return
+
         vert = self._compile_shader(vertex_source, GL.GL_VERTEX_SHADER)
         frag = self._compile_shader(fragment_source, GL.GL_FRAGMENT_SHADER)
         if vert and frag:
             self.glid = GL.glCreateProgram()  # pylint: disable=E1111
             GL.glAttachShader(self.glid, vert)
             GL.glAttachShader(self.glid, frag)
+            if binary_name:
+                GL.glProgramParameteri(self.glid, GL.GL_PROGRAM_BINARY_RETRIEVABLE_HINT, GL.GL_TRUE)
             GL.glLinkProgram(self.glid)
             GL.glDeleteShader(vert)
             GL.glDeleteShader(frag)
@@ -44,8 +105,41 @@ class Shader:
                 print(GL.glGetProgramInfoLog(self.glid).decode('ascii'))
                 GL.glDeleteProgram(self.glid)
                 self.glid = None
+            elif binary_name:
+                self._save_binary(binary_name)
+
+    def _load_binary(self, filename):
+        """ program from a saved binary, None if missing or rejected by the driver """
+        try:
+            data = np.fromfile(filename, np.uint8)
+        except OSError:
+            return None
+        if data.size <= 4:
+            return None
+
+        binary_format, binary = int(data[:4].view(np.uint32)[0]), data[4:]
+        glid = GL.glCreateProgram()  # pylint: disable=E1111
+        GL.glProgramBinary(glid, binary_format, binary, binary.size)
+        if not GL.glGetProgramiv(glid, GL.GL_LINK_STATUS):
+            GL.glDeleteProgram(glid)
+            return None
+        return glid
+
+    def _save_binary(self, filename):
+        size = GL.glGetProgramiv(self.glid, GL.GL_PROGRAM_BINARY_LENGTH)
+        length = np.zeros(1, np.int32)
+        binary_format = np.zeros(1, np.uint32)
+        binary = np.empty(size, np.uint8)
+        GL.glGetProgramBinary(self.glid, size, length, binary_format, binary)
+
+        try:
+            with open(filename, 'wb') as file:
+                file.write(binary_format.tobytes())
+                file.write(binary[:length[0]].tobytes())
+        except OSError as exception:
+            print('Warning: unable to save program binary \'{}\': {}'.format(filename, exception))
 
     def __del__(self):
-        GL.glUseProgram(0)
+        gl_state.use_program(0)
         if self.glid:                      # if this is a valid shader object
             GL.glDeleteProgram(self.glid)  # object dies => destroy GL object
@@ -1,69 +1,173 @@
 #!/usr/bin/env python3
 
+from concurrent.futures import ThreadPoolExecutor
+import hashlib
+import os
+import struct
+
 import OpenGL.GL as GL
 import numpy as np
 from PIL import Image
 
+from core.gl_state import gl_state
+
+
+# Texture cache file: magic, version, width, height and number of levels,
+# then the RGBA bytes of every mipmap level, finest first
+TEXTURE_CACHE_HEADER = struct.Struct('<4sIIII')
+TEXTURE_CACHE_MAGIC = b'SOTT'
+TEXTURE_CACHE_VERSION = 1
+
+# images decoding ahead of their texture, by file name
+_decoder = ThreadPoolExecutor()
+_preloads = {}
+
+
+def set_texture_cache(directory):
+    """ save decoded and mipmapped images in directory and memory map them on later runs """
+    os.makedirs(directory, exist_ok=True)
+    Texture.cache_directory = directory
+
+
+def preload_textures(*filenames):
+    """ start decoding image files in background threads, GL uploads
+        staying with the texture constructors on the context thread """
+    for filename in filenames:
+        if filename not in _preloads:
+            _preloads[filename] = _decoder.submit(_load_levels, filename)
+
+
+def mipmaps(image):
+    """ full chain of RGBA levels down to 1 x 1, each one the 2 x 2 box filtered previous one """
+    levels = [image]
+    while image.shape[0] > 1 or image.shape[1] > 1:
+        height, width = max(image.shape[0] // 2, 1), max(image.shape[1] // 2, 1)
+        pixels = image.astype(np.uint32)
+        pixels = pixels[0:2 * height:2] + pixels[1:2 * height:2] if image.shape[0] > 1 else 2 * pixels
+        pixels = pixels[:, 0:2 * width:2] + pixels[:, 1:2 * width:2] if image.shape[1] > 1 else 2 * pixels
+        image = ((pixels + 2) // 4).astype(np.uint8)
+        levels.append(image)
+    return levels
+
+
+def _levels(filename):
+    future = _preloads.pop(filename, None)
+    return future.result() if future else _load_levels(filename)
+
+
+def _load_levels(filename):
+    """ mipmap levels of an image file, from the texture cache when enabled and up to date """
+    cache_name = None
+    if Texture.cache_directory is not None:
+        try:
+            with open(filename, 'rb') as file:
+                key = hashlib.sha1(file.read())
+            key.update(str(TEXTURE_CACHE_VERSION).encode())
+            cache_name = os.path.join(Texture.cache_directory, key.hexdigest() + '.texture')
+            levels = _read_cache(cache_name)
+            if levels is not None:
+                return levels
+        except OSError:
+            pass  # reported below
+
+    try:
+        data = np.asarray(Image.open(filename).convert('RGBA'))
+    except FileNotFoundError:
+        print('Error: unable to load file \'{}\''.format(filename))
+        return mipmaps(np.full((1, 1, 4), 255, np.uint8))
+
+    levels = mipmaps(data)
+    if cache_name is not None:
+        _write_cache(cache_name, levels)
+    return levels
+
+
+def _read_cache(filename):
+    """ levels memory mapped from a cache file, None if missing or outdated """
+    try:
+        with open(filename, 'rb') as file:
+            magic, version, width, height, nb_levels = TEXTURE_CACHE_HEADER.unpack(
+                file.read(TEXTURE_CACHE_HEADER.size))
+    except (OSError, struct.error):
+        return None
+    if magic != TEXTURE_CACHE_MAGIC or version != TEXTURE_CACHE_VERSION:
+        return None
+
+    levels, offset = [], TEXTURE_CACHE_HEADER.size
+    try:
+        for level in range(nb_levels):
+            shape = (max(height >> level, 1), max(width >> level, 1), 4)
+            levels.append(np.memmap(filename, np.uint8, 'r', offset, shape))
+            offset += levels[-1].nbytes
+    except (OSError, ValueError):
+        return None
+    return levels
+
+
+def _write_cache(filename, levels):
+    height, width = levels[0].shape[:2]
+    try:
+        temporary = filename + '.{}.tmp'.format(os.getpid())
+        with open(temporary, 'wb') as file:
+            file.write(TEXTURE_CACHE_HEADER.pack(TEXTURE_CACHE_MAGIC, TEXTURE_CACHE_VERSION,
+                                                    width, height, len(levels)))
+            for level in levels:
+                file.write(np.ascontiguousarray(level).tobytes())
+        os.replace(temporary, filename)
+    except OSError as exception:
+        print('Warning: unable to save texture cache \'{}\': {}'.format(filename, exception))
+
+
+def _upload(target, levels):
+    """ one glTexImage2D per precomputed mipmap level, no glGenerateMipmap needed """
+    for level, data in enumerate(levels):
+        GL.glTexImage2D(target, level, GL.GL_RGBA, data.shape[1], data.shape[0], 0,
+                        GL.GL_RGBA, GL.GL_UNSIGNED_BYTE, data)
+
 
 class Texture:
+    cache_directory = None  # directory of decoded and mipmapped images, when enabled
+
     def __init__(self, filename):
         self.glid = GL.glGenTextures(1)
 
-        try:
-            data = np.asarray(Image.open(filename).convert('RGBA'))
-        except FileNotFoundError:
-            print('Error: unable to load file \'{}\''.format(filename))
+        levels = _levels(filename)
 
-        GL.glBindTexture(GL.GL_TEXTURE_2D, self.glid)
-
-        width, height = data.shape[1], data.shape[0]
-        GL.glTexImage2D(GL.GL_TEXTURE_2D, 0, GL.GL_RGBA, width, height, 0,
-                        GL.GL_RGBA, GL.GL_UNSIGNED_BYTE, data)
+        gl_state.bind_texture(0, GL.GL_TEXTURE_2D, self.glid)
+        _upload(GL.GL_TEXTURE_2D, levels)
 
         GL.glTexParameteri(GL.GL_TEXTURE_2D, GL.GL_TEXTURE_WRAP_S, GL.GL_CLAMP_TO_EDGE)
         GL.glTexParameteri(GL.GL_TEXTURE_2D, GL.GL_TEXTURE_WRAP_T, GL.GL_CLAMP_TO_EDGE)
         GL.glTexParameteri(GL.GL_TEXTURE_2D, GL.GL_TEXTURE_MAG_FILTER, GL.GL_LINEAR)
         GL.glTexParameteri(GL.GL_TEXTURE_2D, GL.GL_TEXTURE_MIN_FILTER, GL.GL_LINEAR_MIPMAP_LINEAR)
-        GL.glGenerateMipmap(GL.GL_TEXTURE_2D)
 
     def bind(self, texture_unit):
-        GL.glActiveTexture(GL.GL_TEXTURE0 + texture_unit)
-        GL.glBindTexture(GL.GL_TEXTURE_2D, self.glid)
+        gl_state.bind_texture(texture_unit, GL.GL_TEXTURE_2D, self.glid)
 
     def __del__(self):
         GL.glDeleteTextures(self.glid)
+        gl_state.invalidate()
 
 
 class Cubemap:
     def __init__(self, *filenames):
         self.glid = GL.glGenTextures(1)
 
-        GL.glBindTexture(GL.GL_TEXTURE_CUBE_MAP, self.glid)
-        images = {}
+        gl_state.bind_texture(0, GL.GL_TEXTURE_CUBE_MAP, self.glid)
+        # faces share images, each one is decoded once
+        images = {filename: _levels(filename) for filename in set(filenames)}
         for i, filename in enumerate(filenames):
-            try:
-                if filename in images:
-                    data = images[filename]
-                else:
-                    data = np.asarray(Image.open(filename).convert('RGBA'))
-                    images[filename] = data
-            except FileNotFoundError:
-                print('Error: unable to load file \'{}\''.format(filename))
-
-            width, height = data.shape[1], data.shape[0]
-            GL.glTexImage2D(GL.GL_TEXTURE_CUBE_MAP_POSITIVE_X + i, 0, GL.GL_RGBA,
-                            width, height, 0, GL.GL_RGBA, GL.GL_UNSIGNED_BYTE, data)
+            _upload(GL.GL_TEXTURE_CUBE_MAP_POSITIVE_X + i, images[filename])
 
         GL.glTexParameteri(GL.GL_TEXTURE_CUBE_MAP, GL.GL_TEXTURE_WRAP_S, GL.GL_CLAMP_TO_EDGE)
         GL.glTexParameteri(GL.GL_TEXTURE_CUBE_MAP, GL.GL_TEXTURE_WRAP_T, GL.GL_CLAMP_TO_EDGE)
         GL.glTexParameteri(GL.GL_TEXTURE_CUBE_MAP, GL.GL_TEXTURE_WRAP_R, GL.GL_CLAMP_TO_EDGE)
         GL.glTexParameteri(GL.GL_TEXTURE_CUBE_MAP, GL.GL_TEXTURE_MAG_FILTER, GL.GL_LINEAR)
         GL.glTexParameteri(GL.GL_TEXTURE_CUBE_MAP, GL.GL_TEXTURE_MIN_FILTER, GL.GL_LINEAR_MIPMAP_LINEAR)
-        GL.glGenerateMipmap(GL.GL_TEXTURE_CUBE_MAP)
 
     def bind(self, texture_unit):
-        GL.glActiveTexture(GL.GL_TEXTURE0 + texture_unit)
-        GL.glBindTexture(GL.GL_TEXTURE_CUBE_MAP, self.glid)
+        gl_state.bind_texture(texture_unit, GL.GL_TEXTURE_CUBE_MAP, self.glid)
 
     def __del__(self):
         GL.glDeleteTextures(self.glid)
+        gl_state.invalidate()
@@ -25,10 +25,29 @@ def vec(*iterable):
 
 def normalized(vector):
     """ normalized version of any vector, with zero division check """
-    norm = math.sqrt(sum(vector*vector))
+    norm = math.sqrt(np.dot(vector, vector))
     return vector / norm if norm > 0. else vector
 
 
+def _matrix(rows, out=None):
+    """ 4x4 float matrix from nested lists, written into out when given """
+    if out is None:
+        return np.array(rows, 'f')
+    out[...] = rows
+    return out
+
+
+def _floats(values):
+    """ Python floats of a vector, cheaper to compute with than NumPy scalars """
+    return np.asarray(values).tolist()
+
+
+def _unit(x, y, z):
+    """ normalized 3d vector as Python floats, with zero division check """
+    norm = math.sqrt(x*x + y*y + z*z)
+    return (x / norm, y / norm, z / norm) if norm > 0. else (x, y, z)
+
+
 def lerp(point_a, point_b, fraction):
     """ linear interpolation between two quantities with linear operators """
     return point_a + fraction * (point_b - point_a)
@@ -82,27 +101,76 @@ def sincos(degrees=0.0, radians=None):
     return math.sin(radians), math.cos(radians)
 
 
-def rotate(axis=(1., 0., 0.), angle=0.0, radians=None):
+def rotate(axis=(1., 0., 0.), angle=0.0, radians=None, out=None):
     """ 4x4 rotation matrix around 'axis' with 'angle' degrees or 'radians' """
-    x, y, z = normalized(vec(axis))
+    x, y, z = _unit(*_floats(axis)[:3])
     s, c = sincos(angle, radians)
     nc = 1 - c
-    return np.array([[x*x*nc + c,   x*y*nc - z*s, x*z*nc + y*s, 0],
-                     [y*x*nc + z*s, y*y*nc + c,   y*z*nc - x*s, 0],
-                     [x*z*nc - y*s, y*z*nc + x*s, z*z*nc + c,   0],
-                     [0,            0,            0,            1]], 'f')
+    return _matrix([[x*x*nc + c,   x*y*nc - z*s, x*z*nc + y*s, 0],
+                    [y*x*nc + z*s, y*y*nc + c,   y*z*nc - x*s, 0],
+                    [x*z*nc - y*s, y*z*nc + x*s, z*z*nc + c,   0],
+                    [0,            0,            0,            1]], out)
 
 
-def lookat(eye, target, up):
+def lookat(eye, target, up, out=None):
     """ Computes 4x4 view matrix from 3d point 'eye' to 'target',
         'up' 3d vector fixes orientation """
-    view = normalized(vec(target)[:3] - vec(eye)[:3])
-    up = normalized(vec(up)[:3])
-    right = np.cross(view, up)
-    up = np.cross(right, view)
-    rotation = np.identity(4)
-    rotation[:3, :3] = np.vstack([right, up, -view])
-    return rotation @ translate(-eye)
+    ex, ey, ez = _floats(eye)[:3]
+    tx, ty, tz = _floats(target)[:3]
+    vx, vy, vz = _unit(tx - ex, ty - ey, tz - ez)
+    ux, uy, uz = _unit(*_floats(up)[:3])
+    rx, ry, rz = vy*uz - vz*uy, vz*ux - vx*uz, vx*uy - vy*ux  # right = view x up
+    ux, uy, uz = ry*vz - rz*vy, rz*vx - rx*vz, rx*vy - ry*vx  # up = right x view
+    return _matrix([[rx,  ry,  rz,  -(rx*ex + ry*ey + rz*ez)],
+                    [ux,  uy,  uz,  -(ux*ex + uy*ey + uz*ez)],
+                    [-vx, -vy, -vz, vx*ex + vy*ey + vz*ez],
+                    [0,   0,   0,   1]], out)
+
+
+def affine_inverse(matrix, out=None):
+    """ inverse of a 4x4 affine matrix, last row (0, 0, 0, 1), from the
+        adjugate of its 3x3 part """
+    (a, b, c, x), (d, e, f, y), (g, h, i, z), _ = np.asarray(matrix).tolist()
+    co_a, co_b, co_c = e*i - f*h, f*g - d*i, d*h - e*g
+    inv_det = 1.0 / (a*co_a + b*co_b + c*co_c)
+    r00, r01, r02 = co_a * inv_det, (c*h - b*i) * inv_det, (b*f - c*e) * inv_det
+    r10, r11, r12 = co_b * inv_det, (a*i - c*g) * inv_det, (c*d - a*f) * inv_det
+    r20, r21, r22 = co_c * inv_det, (b*g - a*h) * inv_det, (a*e - b*d) * inv_det
+    return _matrix([[r00, r01, r02, -(r00*x + r01*y + r02*z)],
+                    [r10, r11, r12, -(r10*x + r11*y + r12*z)],
+                    [r20, r21, r22, -(r20*x + r21*y + r22*z)],
+                    [0,   0,   0,   1]], out)
+
+
+def frustum_planes(matrix):
+    """ 6 planes (a, b, c, d) of the frustum of a projection @ view matrix,
+        a point being inside when a*x + b*y + c*z + d >= 0 for all of them """
+    matrix = np.asarray(matrix)
+    return np.array([matrix[3] + matrix[0], matrix[3] - matrix[0],
+                     matrix[3] + matrix[1], matrix[3] - matrix[1],
+                     matrix[3] + matrix[2], matrix[3] - matrix[2]])
+
+
+def boxes_in_frustum(planes, lower, upper):
+    """ conservative visibility of (N, 3) axis-aligned boxes: False only for
+        boxes entirely outside one of the frustum planes """
+    normals = planes[:, np.newaxis, :3]
+    farthest = np.where(normals > 0, upper, lower)  # box corner along each plane normal
+    distances = np.sum(farthest * normals, axis=-1) + planes[:, 3:]
+    return np.all(distances >= 0, axis=0)
+
+
+def normal_matrix(matrix, out=None):
+    """ inverse transpose of the 3x3 part of matrix, as a 4x4 matrix for
+        normals (w = 0). The cofactor matrix over the determinant is exact,
+        whether matrix is rigid or scales uniformly or not """
+    (a, b, c, _), (d, e, f, _), (g, h, i, _), _ = np.asarray(matrix).tolist()
+    co_a, co_b, co_c = e*i - f*h, f*g - d*i, d*h - e*g
+    inv_det = 1.0 / (a*co_a + b*co_b + c*co_c)
+    return _matrix([[co_a * inv_det, co_b * inv_det, co_c * inv_det, 0],
+                    [(c*h - b*i) * inv_det, (a*i - c*g) * inv_det, (b*g - a*h) * inv_det, 0],
+                    [(b*f - c*e) * inv_det, (c*d - a*f) * inv_det, (a*e - b*d) * inv_det, 0],
+                    [0, 0, 0, 1]], out)
 
 
 # quaternion functions -------------------------------------------------------
@@ -126,16 +194,38 @@ def quaternion_mul(q1, q2):
                             [q1[3], -q1[2],  q1[1],  q1[0]]]), q2)
 
 
-def quaternion_matrix(q):
+def _rotation_rows(q):
+    """ 3x3 rotation of quaternion q, as rows of Python floats """
+    w, x, y, z = _floats(q)
+    norm = math.sqrt(w*w + x*x + y*y + z*z)  # only unit quaternions are valid rotations.
+    w, x, y, z = (w / norm, x / norm, y / norm, z / norm) if norm > 0. else (w, x, y, z)
+    nxx, nyy, nzz = -x*x, -y*y, -z*z
+    qwx, qwy, qwz = w*x, w*y, w*z
+    qxy, qxz, qyz = x*y, x*z, y*z
+    return ((2*(nyy + nzz) + 1, 2*(qxy - qwz),     2*(qxz + qwy)),
+            (2*(qxy + qwz),     2*(nxx + nzz) + 1, 2*(qyz - qwx)),
+            (2*(qxz - qwy),     2*(qyz + qwx),     2*(nxx + nyy) + 1))
+
+
+def quaternion_matrix(q, out=None):
     """ Create 4x4 rotation matrix from quaternion q """
-    q = normalized(q)  # only unit quaternions are valid rotations.
-    nxx, nyy, nzz = -q[1]*q[1], -q[2]*q[2], -q[3]*q[3]
-    qwx, qwy, qwz = q[0]*q[1], q[0]*q[2], q[0]*q[3]
-    qxy, qxz, qyz = q[1]*q[2], q[1]*q[3], q[2]*q[3]
-    return np.array([[2*(nyy + nzz)+1, 2*(qxy - qwz),   2*(qxz + qwy),   0],
-                     [2 * (qxy + qwz), 2 * (nxx + nzz) + 1, 2 * (qyz - qwx), 0],
-                     [2 * (qxz - qwy), 2 * (qyz + qwx), 2 * (nxx + nyy) + 1, 0],
-                     [0, 0, 0, 1]], 'f')
+    rows = _rotation_rows(q)
+    return _matrix([[*rows[0], 0], [*rows[1], 0], [*rows[2], 0], [0, 0, 0, 1]], out)
+
+
+def compose_trs(translation, rotation, scaling, out=None):
+    """ translate(translation) @ quaternion_matrix(rotation) @ scale(scaling)
+        in one go, scaling being uniform or per axis """
+    tx, ty, tz = _floats(translation)[:3]
+    if isinstance(scaling, Number) or np.ndim(scaling) == 0:
+        sx = sy = sz = float(scaling)
+    else:
+        sx, sy, sz = _floats(scaling)[:3]
+    (r00, r01, r02), (r10, r11, r12), (r20, r21, r22) = _rotation_rows(rotation)
+    return _matrix([[r00*sx, r01*sy, r02*sz, tx],
+                    [r10*sx, r11*sy, r12*sz, ty],
+                    [r20*sx, r21*sy, r22*sz, tz],
+                    [0,      0,      0,      1]], out)
 
 
 def quaternion_slerp(q0, q1, fraction):
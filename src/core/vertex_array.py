@@ -6,6 +6,8 @@
 import OpenGL.GL as GL
 import numpy as np
 
+from core.gl_state import gl_state
+
 
 class VertexArray:
     """ helper class to create and self destroy OpenGL vertex array objects."""
@@ -15,7 +17,7 @@ class VertexArray:
 
         # create vertex array object, bind it
         self.glid = GL.glGenVertexArrays(1)
-        GL.glBindVertexArray(self.glid)
+        gl_state.bind_vertex_array(self.glid)
         self.buffers = []  # we will store buffers in a list
         nb_primitives, size = 0, 0
 
@@ -24,7 +26,7 @@ class VertexArray:
             if data is not None:
                 # bind a new vbo, upload its data to GPU, declare size and type
                 self.buffers.append(GL.glGenBuffers(1))
-                data = np.array(data, np.float32, copy=False)  # ensure format
+                data = np.asarray(data, np.float32)  # ensure format
                 nb_primitives, size = data.shape
                 GL.glEnableVertexAttribArray(loc)
                 GL.glBindBuffer(GL.GL_ARRAY_BUFFER, self.buffers[-1])
@@ -33,20 +35,30 @@ class VertexArray:
 
         # optionally create and upload an index buffer for this object
         self.draw_command = GL.glDrawArrays
+        self.instanced_command = GL.glDrawArraysInstanced
         self.arguments = (0, nb_primitives)
         if index is not None:
             self.buffers += [GL.glGenBuffers(1)]
-            index_buffer = np.array(index, np.int32, copy=False)  # good format
+            index_buffer = np.asarray(index, np.uint32)  # good format
             GL.glBindBuffer(GL.GL_ELEMENT_ARRAY_BUFFER, self.buffers[-1])
             GL.glBufferData(GL.GL_ELEMENT_ARRAY_BUFFER, index_buffer, usage)
             self.draw_command = GL.glDrawElements
+            self.instanced_command = GL.glDrawElementsInstanced
             self.arguments = (index_buffer.size, GL.GL_UNSIGNED_INT, None)
 
-    def execute(self, primitive):
-        """ draw a vertex array, either as direct array or indexed array """
-        GL.glBindVertexArray(self.glid)
-        self.draw_command(primitive, *self.arguments)
+    def execute(self, primitive, nb_instances=None):
+        """ draw a vertex array, either as direct array or indexed array,
+            nb_instances times in one call when given """
+        if nb_instances == 0:
+            return
+        gl_state.bind_vertex_array(self.glid)
+        if nb_instances is None:
+            self.draw_command(primitive, *self.arguments)
+        else:
+            self.instanced_command(primitive, *self.arguments, nb_instances)
+        gl_state.stats['draw_calls'] += 1
 
     def __del__(self):  # object dies => kill GL array and buffers from GPU
         GL.glDeleteVertexArrays(1, [self.glid])
         GL.glDeleteBuffers(len(self.buffers), self.buffers)
+        gl_state.invalidate()
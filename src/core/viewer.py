@@ -1,16 +1,32 @@
 #!/usr/bin/env python3
 
+from time import perf_counter
+
 import OpenGL.GL as GL
 import glfw
 
+from core.capture import FrameRecorder
+from core.framebuffer import ColorFramebuffer
+from core.gl_state import gl_state
 from core.node import Node
+from core.profiler import profiler
+from core.render_queue import RenderQueue, BACKGROUND
+from core.resolution import DynamicResolution
 from core.transform import identity
 
 
 class Viewer(Node):
-    """ GLFW viewer window, with classic initialization & graphics loop """
-    def __init__(self, width, height, title):
+    """ GLFW viewer window, with classic initialization & graphics loop.
+        A headless viewer renders into an offscreen framebuffer of fixed size
+        behind an invisible window, and a given delta_time replaces wall clock
+        time between updates. Given a frame_budget in milliseconds, the 3D
+        scene renders at the resolution holding frame times to it, upscaled
+        under overlays drawn at full resolution, which needs the render queue """
+    def __init__(self, width, height, title, render_queue=False, headless=False, delta_time=None,
+                    frame_budget=None):
         super().__init__()
+        if frame_budget and not render_queue:
+            raise ValueError('dynamic resolution draws overlays after the scene, it needs the render queue')
 
         # version hints: create GL window with >= OpenGL 3.3 and core profile
         glfw.window_hint(glfw.CONTEXT_VERSION_MAJOR, 3)
@@ -18,12 +34,29 @@ class Viewer(Node):
         glfw.window_hint(glfw.OPENGL_FORWARD_COMPAT, GL.GL_TRUE)
         glfw.window_hint(glfw.OPENGL_PROFILE, glfw.OPENGL_CORE_PROFILE)
         glfw.window_hint(glfw.RESIZABLE, True)
-        glfw.window_hint(glfw.SAMPLES, 4)
+        # upscaling blits into the window, which multisampling forbids
+        glfw.window_hint(glfw.SAMPLES, 0 if headless or frame_budget else 4)
+        glfw.window_hint(glfw.VISIBLE, not headless)
 
         self.title = title
         self.window = glfw.create_window(width, height, self.title, None, None)
+        if not self.window:
+            raise RuntimeError('unable to create an OpenGL 3.3 core profile context')
         glfw.make_context_current(self.window)
 
+        # the scene renders to the offscreen framebuffer as it would to the window
+        self.offscreen = ColorFramebuffer(width, height) if headless else None
+        if self.offscreen:
+            gl_state.framebuffer = self.offscreen.glid
+            GL.glBindFramebuffer(GL.GL_FRAMEBUFFER, gl_state.framebuffer)
+            GL.glViewport(0, 0, width, height)
+        self.delta_time = delta_time
+        self.recorder = None
+
+        # 3D scene at a lower resolution when frames exceed their budget
+        self.resolution = DynamicResolution(self.size(), frame_budget) if frame_budget else None
+        self.stats = {'resolution_scale': 1.0, 'frame_budget': frame_budget}
+
         # default OpenGL state
         GL.glClearColor(0, 0, 0, 0)
         GL.glEnable(GL.GL_CULL_FACE)
@@ -36,18 +69,44 @@ class Viewer(Node):
         GL.glEnable(GL.GL_MULTISAMPLE)
 
         glfw.set_key_callback(self.window, self.on_key)
-        glfw.set_window_size_callback(self.window, self.on_size)
+        if not self.offscreen:
+            glfw.set_window_size_callback(self.window, self.on_size)
 
         self.camera = None
 
+        # sorted submission of the scene instead of drawing in scene graph order
+        self.render_queue = RenderQueue() if render_queue else None
+
     def set_camera(self, camera):
         self.camera = camera
-        self.camera.viewport = glfw.get_framebuffer_size(self.window)
+        self.camera.viewport = self.size()
         glfw.set_cursor_pos_callback(self.window, self.camera.on_mouse_move)
         glfw.set_scroll_callback(self.window, self.camera.on_scroll)
 
-    def run(self):
-        """ Main render loop for this OpenGL window """
+    def size(self):
+        """ size of the framebuffer the scene renders to """
+        if self.offscreen:
+            return self.offscreen.size
+        return glfw.get_framebuffer_size(self.window)
+
+    def start_recording(self, path):
+        """ capture every frame to path, a raw RGB24 stream if it ends in .rgb or
+            .raw, a directory of PNG images otherwise """
+        self.stop_recording()
+        self.recorder = FrameRecorder(path, self.size())
+        print('Recording {}x{} frames to {}'.format(*self.recorder.size, path))
+
+    def stop_recording(self):
+        """ finish writing the recorded frames """
+        if self.recorder:
+            self.recorder.close()
+            print('Recorded {} frames to {}'.format(self.recorder.nb_frames, self.recorder.path))
+            self.recorder = None
+
+    def run(self, nb_frames=None, timings=None):
+        """ Main render loop for this OpenGL window, stopping after nb_frames
+            when given, and appending the update, draw and swap seconds of
+            every frame to timings when given """
         if self.camera is None:
             print('Warning: Viewer.camera is None')
             return
@@ -55,26 +114,67 @@ class Viewer(Node):
         last_update = glfw.get_time()
         last_framerate_update = last_update
         nb_frames_per_second = 0
-        while not glfw.window_should_close(self.window):
+        nb_frames_done = 0
+        model = identity()  # same root matrix every frame, for nodes to reuse their world matrices
+        while not glfw.window_should_close(self.window) and nb_frames != nb_frames_done:
+            gl_state.new_frame()
+            profiler.begin_frame()
+            start = perf_counter()
+
             # clear draw buffer and depth buffer
             GL.glClear(GL.GL_COLOR_BUFFER_BIT | GL.GL_DEPTH_BUFFER_BIT)
 
             # update our scene
             current_time = glfw.get_time()
-            delta_time = current_time - last_update
-            self.update(delta_time)
+            delta_time = current_time - last_update if self.delta_time is None else self.delta_time
+            with profiler.scope('update', gpu=False):
+                self.update(delta_time)
             last_update = current_time
+            updated = perf_counter()
 
             # get view and projection matrix from camera
-            size = glfw.get_window_size(self.window)
+            size = self.offscreen.size if self.offscreen else glfw.get_window_size(self.window)
             view = self.camera.view_matrix()
             projection = self.camera.projection_matrix(size)
 
             # draw our scene
-            self.draw(projection, view, identity(), identity(), self.camera)
-
-            # flush and swap buffers
-            glfw.swap_buffers(self.window)
+            if self.render_queue is None:
+                with profiler.scope('main pass'):
+                    self.draw(projection, view, model, self.camera)
+            else:
+                self.render_queue.begin(self.camera.position)
+                if self.resolution:
+                    self.camera.viewport = self.resolution.begin()
+                with profiler.scope('traversal'):
+                    self.queue(self.render_queue, projection, view, model, self.camera)
+                with profiler.scope('main pass'):
+                    if self.resolution:
+                        # overlays come after the upscaled scene, at full resolution
+                        self.render_queue.flush(BACKGROUND)
+                        self.resolution.end(self.offscreen.glid if self.offscreen else 0)
+                        self.camera.viewport = self.resolution.size
+                    self.render_queue.flush()
+            drawn = perf_counter()
+
+            # read the frame back without waiting, while recording
+            if self.recorder:
+                with profiler.scope('capture'):
+                    self.recorder.capture()
+
+            # flush and swap buffers, or wait for the offscreen frame to complete
+            with profiler.scope('swap', gpu=False):
+                if self.offscreen:
+                    GL.glFinish()
+                else:
+                    glfw.swap_buffers(self.window)
+            nb_frames_done += 1
+            if timings is not None:
+                timings.append((updated - start, drawn - updated, perf_counter() - drawn))
+            profiler.end_frame()
+
+            if self.resolution:
+                self.resolution.adapt(1000 * (perf_counter() - start))
+                self.stats['resolution_scale'] = self.resolution.scale
 
             # update framerate information
             nb_frames_per_second += 1
@@ -82,7 +182,11 @@ class Viewer(Node):
             delta_time = current_time - last_framerate_update
             if delta_time >= 1:
                 ms_per_frame = 1000 * delta_time / nb_frames_per_second
-                glfw.set_window_title(self.window, '{} - {:.1f} ms'.format(self.title, ms_per_frame))
+                title = '{} - {:.1f} ms - {draw_calls} draws, {program_binds} programs, {texture_binds} textures'.format(
+                    self.title, ms_per_frame, **gl_state.stats)
+                if self.resolution:
+                    title += ' - {resolution_scale:.0%} resolution for {frame_budget} ms'.format(**self.stats)
+                glfw.set_window_title(self.window, title)
                 last_framerate_update = current_time
                 nb_frames_per_second = 0
 
@@ -103,3 +207,5 @@ class Viewer(Node):
         viewport = glfw.get_framebuffer_size(window)
         GL.glViewport(0, 0, *viewport)
         self.camera.viewport = viewport
+        if self.resolution and all(viewport):
+            self.resolution.resize(viewport)
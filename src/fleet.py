@@ -0,0 +1,68 @@
+#!/usr/bin/env python3
+
+import numpy as np
+
+from core.node import Node
+from model.model import InstancedModel
+from player import SHIP_NAME, SHIP_MAX_SIZE, HEIGHT_DEFAULT, HEIGHT_WATER_SCALING
+
+
+FLEET_SIZE = 200
+FLEET_RADII = (20, 160)
+FLEET_SPEEDS = (1, 3)
+FLEET_TINTS = (0.5, 1)
+
+
+class Fleet(Node):
+    """ AI ships sailing circles around the start and riding the waves, all
+        drawn as instances of a single model """
+    def __init__(self, lights_manager, water, nb_ships=FLEET_SIZE, seed=0):
+        super().__init__()
+
+        self.water = water
+
+        self.ships = InstancedModel(SHIP_NAME, lights_manager)
+        self.add(self.ships)
+
+        lowers, uppers = zip(*[child.bounds for child in self.ships.children])
+        lower, upper = np.min(lowers, axis=0), np.max(uppers, axis=0)
+        self.scaling = SHIP_MAX_SIZE / np.max(upper - lower)
+        self.local_center = self.scaling * (lower + upper) / 2
+
+        # each ship circles a center of its own, clockwise or not
+        random = np.random.default_rng(seed)
+        distances = random.uniform(*FLEET_RADII, nb_ships)
+        bearings = random.uniform(0, 2 * np.pi, nb_ships)
+        self.centers = np.column_stack((distances * np.cos(bearings), distances * np.sin(bearings)))
+        self.radii = random.uniform(0.1, 0.5, nb_ships) * distances
+        self.phases = random.uniform(0, 2 * np.pi, nb_ships)
+        self.angular_velocities = (random.choice((-1, 1), nb_ships)
+                                    * random.uniform(*FLEET_SPEEDS, nb_ships) / self.radii)
+        self.tints = random.uniform(*FLEET_TINTS, (nb_ships, 3))
+
+        self.transforms = np.zeros((nb_ships, 4, 4), np.float32)
+        self.transforms[:, 3, 3] = 1
+        self.time = 0
+
+    def update(self, delta_time):
+        self.time += delta_time
+        angles = self.phases + self.time * self.angular_velocities
+        xs = self.centers[:, 0] + self.radii * np.cos(angles)
+        zs = self.centers[:, 1] - self.radii * np.sin(angles)
+        heights = HEIGHT_DEFAULT + HEIGHT_WATER_SCALING * self.water.heights(xs, zs, cached=False)
+
+        # ships face along their circle, rotating about their center like the
+        # player's ship, their keel at the water height
+        yaws = angles + np.where(self.angular_velocities > 0, 0, np.pi)
+        sines, cosines = np.sin(yaws), np.cos(yaws)
+        rotations = np.zeros((len(yaws), 3, 3))
+        rotations[:, 0, 0], rotations[:, 0, 2] = cosines, sines
+        rotations[:, 1, 1] = 1
+        rotations[:, 2, 0], rotations[:, 2, 2] = -sines, cosines
+
+        self.transforms[:, :3, :3] = self.scaling * rotations
+        pivots = rotations @ self.local_center
+        self.transforms[:, :3, 3] = np.column_stack((xs - pivots[:, 0], heights, zs - pivots[:, 2]))
+        self.ships.set_instances(self.transforms, self.tints)
+
+        super().update(delta_time)
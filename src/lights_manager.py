@@ -1,37 +1,69 @@
 #!/usr/bin/env python3
 
 import OpenGL.GL as GL
+import numpy as np
 
+from core.gl_state import gl_state
+from core.profiler import profiler
 from core.node import Node
 from core.transform import vec, ortho, lookat, identity
 from core.framebuffer import Framebuffer
+from shadow.shadow import ShadowCaster, SHADOW_WIDTH, SHADOW_HEIGHT
 
 
 NB_MAX_POINT_LIGHTS = 8
-SHADOW_WIDTH, SHADOW_HEIGHT = 1024, 1024
-SHADOW_PROJECTION = ortho(-4.5, 4.5, -4.5, 4.5, 48, 80)
+SHADOW_HALF_SIZE = 4.5
+SHADOW_PROJECTION = ortho(-SHADOW_HALF_SIZE, SHADOW_HALF_SIZE, -SHADOW_HALF_SIZE, SHADOW_HALF_SIZE, 48, 80)
+SHADOW_TEXEL_SIZE = np.array([2 * SHADOW_HALF_SIZE / SHADOW_WIDTH, 2 * SHADOW_HALF_SIZE / SHADOW_HEIGHT])
 SHADOW_DISTANCE = 64
+SHADOW_INTERVAL = 2  # frames between two renders of a changing shadow map
+SHADOW_TEXTURE_UNIT = 8
+LIGHTS_BINDING, SHADOW_BINDING = 0, 1
+
+# std140 layout of the Lights block, in floats: vec3 members and structs are 16 bytes aligned
+POINT_LIGHT_STRIDE = 8
+DIRECTIONAL_LIGHT_OFFSET = NB_MAX_POINT_LIGHTS * POINT_LIGHT_STRIDE
+NB_POINT_LIGHTS_OFFSET = DIRECTIONAL_LIGHT_OFFSET + 8
+LIGHTS_BLOCK_SIZE = NB_POINT_LIGHTS_OFFSET + 4
 
 
 class LightsManager(Node):
-    def __init__(self):
+    def __init__(self, shadow_interval=SHADOW_INTERVAL):
         super().__init__()
-        self.locations = {}
+        self.shaders = set()
         self.point_lights = []
         self.directional_light = ((0, -1, 0), (0, 0, 0))
         self.shadow = Framebuffer(SHADOW_WIDTH, SHADOW_HEIGHT)
+        self.shadow_caster = ShadowCaster()
         self.shadow_viewproj = identity()
 
+        # the shadow map is rendered again only when what it shows changed
+        self.shadow_interval = shadow_interval
+        self.shadow_state, self.shadow_age = None, 0
+        self.stats = {'shadow_renders': 0, 'shadow_reuses': 0}
+
+        # uniform buffers shared by every shader, uploaded once per frame
+        self.lights_buffer, self.shadow_buffer = GL.glGenBuffers(2)
+        for buffer, binding, size in ((self.lights_buffer, LIGHTS_BINDING, 4 * LIGHTS_BLOCK_SIZE),
+                                        (self.shadow_buffer, SHADOW_BINDING, self.shadow_viewproj.nbytes)):
+            GL.glBindBuffer(GL.GL_UNIFORM_BUFFER, buffer)
+            GL.glBufferData(GL.GL_UNIFORM_BUFFER, size, None, GL.GL_DYNAMIC_DRAW)
+            GL.glBindBufferBase(GL.GL_UNIFORM_BUFFER, binding, buffer)
+        GL.glBindBuffer(GL.GL_UNIFORM_BUFFER, 0)
+
     def add_shader(self, shader):
-        names = ['nb_point_lights']
-        for i in range(NB_MAX_POINT_LIGHTS):
-            names.append('point_lights[{}].position'.format(i))
-            names.append('point_lights[{}].color_intensity'.format(i))
+        """ bind the shader's light blocks and shadow map sampler, once and for all """
+        if shader in self.shaders:
+            return
+        self.shaders.add(shader)
 
-        names += ['directional_light.direction', 'directional_light.color_intensity',
-                    'shadow_viewproj', 'shadow_map']
+        for name, binding in (('Lights', LIGHTS_BINDING), ('Shadow', SHADOW_BINDING)):
+            index = GL.glGetUniformBlockIndex(shader.glid, name)
+            if index != GL.GL_INVALID_INDEX:
+                GL.glUniformBlockBinding(shader.glid, index, binding)
 
-        self.locations[shader] = {name: GL.glGetUniformLocation(shader.glid, name) for name in names}
+        gl_state.use_program(shader.glid)
+        GL.glUniform1i(GL.glGetUniformLocation(shader.glid, 'shadow_map'), SHADOW_TEXTURE_UNIT)
 
     def add_point_light(self, position, color_intensity):
         self.point_lights.append((position, color_intensity))
@@ -39,39 +71,93 @@ class LightsManager(Node):
     def set_directional_light(self, direction, color_intensity):
         self.directional_light = (direction, color_intensity)
 
-    def set_uniforms(self, shader, texture_unit):
-        locations = self.locations[shader]
-
-        GL.glUniform1i(locations['nb_point_lights'], len(self.point_lights))
-        for i, point_light in enumerate(self.point_lights):
-            position, color_intensity = point_light
-            GL.glUniform3fv(locations['point_lights[{}].position'.format(i)], 1, position)
-            GL.glUniform3fv(locations['point_lights[{}].color_intensity'.format(i)], 1, color_intensity)
+    def upload(self):
+        """ write lights and shadow data into the uniform buffers, bind the shadow map """
+        lights = np.zeros(LIGHTS_BLOCK_SIZE, np.float32)
+        for i, (position, color_intensity) in enumerate(self.point_lights[:NB_MAX_POINT_LIGHTS]):
+            offset = i * POINT_LIGHT_STRIDE
+            lights[offset:offset + 3] = position
+            lights[offset + 4:offset + 7] = color_intensity
 
         direction, color_intensity = self.directional_light
-        GL.glUniform3fv(locations['directional_light.direction'], 1, direction)
-        GL.glUniform3fv(locations['directional_light.color_intensity'], 1, color_intensity)
-
-        GL.glUniformMatrix4fv(locations['shadow_viewproj'], 1, True, self.shadow_viewproj)
-        GL.glActiveTexture(GL.GL_TEXTURE0 + texture_unit)
-        GL.glBindTexture(GL.GL_TEXTURE_2D, self.shadow.texture_glid)
-        GL.glUniform1i(locations['shadow_map'], texture_unit)
+        lights[DIRECTIONAL_LIGHT_OFFSET:DIRECTIONAL_LIGHT_OFFSET + 3] = direction
+        lights[DIRECTIONAL_LIGHT_OFFSET + 4:DIRECTIONAL_LIGHT_OFFSET + 7] = color_intensity
+        lights.view(np.int32)[NB_POINT_LIGHTS_OFFSET] = len(self.point_lights)
+
+        GL.glBindBuffer(GL.GL_UNIFORM_BUFFER, self.lights_buffer)
+        GL.glBufferSubData(GL.GL_UNIFORM_BUFFER, 0, lights.nbytes, lights)
+        GL.glBindBuffer(GL.GL_UNIFORM_BUFFER, self.shadow_buffer)
+        GL.glBufferSubData(GL.GL_UNIFORM_BUFFER, 0, 64, np.asarray(self.shadow_viewproj, np.float32))
+        GL.glBindBuffer(GL.GL_UNIFORM_BUFFER, 0)
+
+        gl_state.bind_texture(SHADOW_TEXTURE_UNIT, GL.GL_TEXTURE_2D, self.shadow.texture_glid)
+
+    def draw(self, projection, view, model, camera):
+        self._shadow_pass(model, camera)
+        super().draw(projection, view, model, camera)
+
+    def queue(self, render_queue, projection, view, model, camera):
+        self._shadow_pass(model, camera)
+        super().queue(render_queue, projection, view, model, camera)
+
+    def invalidate_shadow(self):
+        """ render the shadow map at the next frame, even if nothing changed """
+        self.shadow_state = None
+
+    def render_shadow(self, model, camera):
+        """ render the shadow map, unless it was rendered less than shadow_interval
+            frames ago or the light view is as it was then, every caster within a texel.
+            Return whether it was rendered """
+        self.shadow_age += 1
+        if self.shadow_state is not None and self.shadow_age < self.shadow_interval:
+            self.stats['shadow_reuses'] += 1
+            return False
+
+        shadow_viewproj = self._shadow_viewproj(camera)
+        state = (shadow_viewproj.tobytes(), self.shadow_key(model, shadow_viewproj))
+        if state == self.shadow_state:
+            self.stats['shadow_reuses'] += 1
+            return False
+        self.shadow_state, self.shadow_age = state, 0
+        self.shadow_viewproj = shadow_viewproj
 
-    def draw(self, projection, view, model, normal_matrix, camera):
         GL.glViewport(0, 0, SHADOW_WIDTH, SHADOW_HEIGHT)
         GL.glBindFramebuffer(GL.GL_FRAMEBUFFER, self.shadow.glid)
         GL.glClear(GL.GL_DEPTH_BUFFER_BIT)
 
+        # depth only, back faces to keep acne off the lit side
+        GL.glCullFace(GL.GL_FRONT)
+        self.shadow_caster.use(self.shadow_viewproj)
+        self.draw_shadow(self.shadow_caster, model)
+        GL.glCullFace(GL.GL_BACK)
+        GL.glBindFramebuffer(GL.GL_FRAMEBUFFER, gl_state.framebuffer)
+
+        self.stats['shadow_renders'] += 1
+        return True
+
+    def _shadow_viewproj(self, camera):
+        """ light view and projection centered on the player, moved by whole
+            shadow map texels so that shadows do not shimmer as the ship moves """
         direction, _ = self.directional_light
+        light_view = lookat(-SHADOW_DISTANCE * vec(direction), vec(0, 0, 0), vec(0, 1, 0))
+        rotation = light_view[:3, :3]
+
         target = camera.player.position + camera.player.local_center
-        light_position = target - SHADOW_DISTANCE * vec(direction)
-        light_view = lookat(light_position, target, vec(0, 1, 0))
-        self.shadow_viewproj = SHADOW_PROJECTION @ light_view
+        light_target = rotation @ target
+        snapped = np.copy(light_target)
+        snapped[:2] = SHADOW_TEXEL_SIZE * np.round(light_target[:2] / SHADOW_TEXEL_SIZE)
+        target = target + np.linalg.solve(rotation, snapped - light_target)
+
+        light_view = lookat(target - SHADOW_DISTANCE * vec(direction), target, vec(0, 1, 0))
+        return SHADOW_PROJECTION @ light_view
+
+    def _shadow_pass(self, model, camera):
+        """ render the shadow map if needed, upload the light blocks and clear the scene for the main pass """
+        with profiler.scope('shadow pass'):
+            self.render_shadow(model, camera)
 
-        super().draw(SHADOW_PROJECTION, light_view, model, normal_matrix, camera)
-        GL.glBindFramebuffer(GL.GL_FRAMEBUFFER, 0)
+        self.upload()
 
         # Render scene
         GL.glViewport(0, 0, *camera.viewport)
         GL.glClear(GL.GL_COLOR_BUFFER_BIT | GL.GL_DEPTH_BUFFER_BIT)
-        super().draw(projection, view, model, normal_matrix, camera)
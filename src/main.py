@@ -1,19 +1,63 @@
 #!/usr/bin/env python3
 
+import argparse
+import os
+
 import glfw
 
 from core.viewer import Viewer
-from parchment.parchment import Parchment
+from core.shader import Shader
+from core.texture import set_texture_cache, preload_textures
+from core.keyframes import KeyFrameGroup
+from model.model import set_model_cache, preload_models
+from parchment.parchment import Parchment, TEXTURE_NAME
 from lights_manager import LightsManager
-from skybox.skybox import Skybox
+from skybox.skybox import Skybox, TEXTURES_BACK_NAME, TEXTURES_FRONT_NAME
 from water.water import Water
-from player import Player
-from officer import Officer
+from player import Player, SHIP_NAME
+from officer import Officer, OFFICER_NAME
+from chunks import ChunkManager
 from camera import Camera
 
 
+CACHE_DIRECTORY = os.path.join(os.path.expanduser('~'), '.cache', 'sea-of-triangles')
+
 def main():
-    viewer = Viewer(960, 540, "Sea of Triangles")
+    parser = argparse.ArgumentParser(description='Sea of Triangles')
+    parser.add_argument('--record', metavar='PATH',
+                        help='record the game, as a raw RGB24 stream if PATH ends in .rgb, else as PNG images')
+    parser.add_argument('--frame-budget', type=float, metavar='MS',
+                        help='lower the 3D resolution to hold frame times to MS milliseconds')
+    args = parser.parse_args()
+
+    viewer = Viewer(960, 540, "Sea of Triangles", render_queue=True, frame_budget=args.frame_budget)
+    lights_manager = build_scene(viewer)
+
+    print("How to play:\n" +
+            "\tup: move forward\n" +
+            "\tleft / right: rotate\n" +
+            "\tleft mouse button: rotate the camera up and down\n" +
+            "\tscroll wheel: zoom in and out\n" +
+            "\th: show / hide the help\n" +
+            "\tescape: quit")
+
+    if args.record:
+        viewer.start_recording(args.record)
+    viewer.run()
+    viewer.stop_recording()
+
+    release_scene(lights_manager)
+
+
+def build_scene(viewer):
+    """ add the game scene to viewer, return its lights manager for release_scene """
+    Shader.set_binary_cache(os.path.join(CACHE_DIRECTORY, 'shaders'))
+    set_model_cache(os.path.join(CACHE_DIRECTORY, 'models'))
+    set_texture_cache(os.path.join(CACHE_DIRECTORY, 'textures'))
+
+    # models and images load in the background while the rest of the scene is built
+    preload_models(SHIP_NAME, OFFICER_NAME)
+    preload_textures(TEXTURE_NAME, *TEXTURES_BACK_NAME, *TEXTURES_FRONT_NAME)
 
     parchment = Parchment()
     viewer.add(parchment)
@@ -24,31 +68,30 @@ def main():
 
     skybox = Skybox()
 
-    water = Water(lights_manager, skybox)
+    water = Water(lights_manager, skybox, cache_heights=True)
     parchment.add(water)
 
     parchment.add(skybox)
 
     player = Player(lights_manager, water)
-    player.add(Officer(lights_manager))
+    crew = KeyFrameGroup()  # keyframed characters on deck, animated in one batch
+    crew.add(Officer(lights_manager))
+    player.add(crew)
     lights_manager.add(player)
 
+    lights_manager.add(ChunkManager(lights_manager, water, player))
+
     camera = Camera(player)
     viewer.set_camera(camera)
     viewer.add(camera)
 
-    print("How to play:\n" +
-            "\tup: move forward\n" +
-            "\tleft / right: rotate\n" +
-            "\tleft mouse button: rotate the camera up and down\n" +
-            "\tscroll wheel: zoom in and out\n" +
-            "\th: show / hide the help\n" +
-            "\tescape: quit")
+    return lights_manager
 
-    viewer.run()
 
-    # Remove circular references to avoid errors with glDelete*
+def release_scene(lights_manager):
+    """ Remove circular references to avoid errors with glDelete* """
     lights_manager.children = None
+    Shader.clear_cache()
 
 
 if __name__ == '__main__':
@@ -9,25 +9,38 @@
 in vec3 w_position;
 in vec3 w_normal;
 in vec3 shadow_frag_pos;
+flat in int material_index;
+flat in vec3 tint;
 
-uniform int nb_point_lights;
-
-uniform struct PointLight {
+struct PointLight {
     vec3 position;
     vec3 color_intensity;
-} point_lights[NB_MAX_POINT_LIGHTS];
+};
+
+struct Material {
+    vec3 k_a;
+    vec3 k_d;
+    vec3 k_s;
+    float s;
+};
 
-uniform struct DirectionalLight {
+struct DirectionalLight {
     vec3 direction;
     vec3 color_intensity;
-} directional_light;
+};
+
+layout(std140) uniform Lights {
+    PointLight point_lights[NB_MAX_POINT_LIGHTS];
+    DirectionalLight directional_light;
+    int nb_point_lights;
+};
 
 uniform sampler2DShadow shadow_map;
 
-uniform vec3 k_a;
-uniform vec3 k_d;
-uniform vec3 k_s;
-uniform float s;
+uniform vec3 k_a[NB_MAX_MATERIALS];
+uniform vec3 k_d[NB_MAX_MATERIALS];
+uniform vec3 k_s[NB_MAX_MATERIALS];
+uniform float s[NB_MAX_MATERIALS];
 
 uniform vec3 w_camera_position;
 
@@ -37,30 +50,30 @@ vec3 fromLinear(vec3 color) {
     return pow(color, vec3(1.0 / 2.2));
 }
 
-vec3 pointLight(PointLight light, vec3 n, vec3 v) {
+vec3 pointLight(PointLight light, Material material, vec3 n, vec3 v) {
     vec3 l = light.position - w_position;
     float inv_dist_squared = 1.0 / dot(l, l);
     l = normalize(l);
     vec3 r = reflect(-l, n);
 
     float diffuse_coeff = max(dot(n, l), 0.0);
-    vec3 diffuse = k_d * diffuse_coeff;
+    vec3 diffuse = material.k_d * diffuse_coeff;
 
-    float specular_coeff = pow(max(dot(r, v), 0.0), s);
-    vec3 specular = k_s * specular_coeff;
+    float specular_coeff = pow(max(dot(r, v), 0.0), material.s);
+    vec3 specular = material.k_s * specular_coeff;
 
     return light.color_intensity * (diffuse + specular) * inv_dist_squared;
 }
 
-vec3 directionalLight(DirectionalLight light, vec3 n, vec3 v) {
+vec3 directionalLight(DirectionalLight light, Material material, vec3 n, vec3 v) {
     vec3 l = normalize(-light.direction);
     vec3 r = reflect(-l, n);
 
     float diffuse_coeff = max(dot(n, l), 0.0);
-    vec3 diffuse = k_d * diffuse_coeff;
+    vec3 diffuse = material.k_d * diffuse_coeff;
 
-    float specular_coeff = pow(max(dot(r, v), 0.0), s);
-    vec3 specular = k_s * specular_coeff;
+    float specular_coeff = pow(max(dot(r, v), 0.0), material.s);
+    vec3 specular = material.k_s * specular_coeff;
 
     return light.color_intensity * (diffuse + specular);
 }
@@ -88,15 +101,18 @@ void main() {
     vec3 n = normalize(w_normal);
     vec3 v = normalize(w_camera_position - w_position);
 
-    vec3 color = directionalLight(directional_light, n, v);
+    Material material = Material(tint * k_a[material_index], tint * k_d[material_index],
+                                 k_s[material_index], s[material_index]);
+
+    vec3 color = directionalLight(directional_light, material, n, v);
 
     for (int i = 0; i < nb_point_lights && i < NB_MAX_POINT_LIGHTS; ++i) {
-        color += pointLight(point_lights[i], n, v);
+        color += pointLight(point_lights[i], material, n, v);
     }
 
     vec3 l = normalize(-directional_light.direction);
     float shadow = mix(0.6, 1.0, shadowFactor(shadow_frag_pos, n, l));
-    color = k_a + shadow * color;
+    color = material.k_a + shadow * color;
 
     out_color = vec4(fromLinear(color), 1.0);
 }
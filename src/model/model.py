@@ -1,75 +1,329 @@
 #!/usr/bin/env python3
 
+from concurrent.futures import ThreadPoolExecutor
+import ctypes
+import hashlib
+import json
+import os
+import struct
+
 import OpenGL.GL as GL
 import numpy as np
 import assimpcy
 
+from core.gl_state import gl_state
 from core.shader import Shader
 from core.mesh import Mesh
+from core.node import Node
+from core.transform import normal_matrix, frustum_planes, boxes_in_frustum
+from shadow.shadow import shadow_texels
 
 
 VERTEX_SHADER_NAME = 'model/model.vert'
 FRAGMENT_SHADER_NAME = 'model/model.frag'
+NB_MAX_MATERIALS = 16
+IMPORT_FLAGS = (assimpcy.aiPostProcessSteps.aiProcess_Triangulate
+                | assimpcy.aiPostProcessSteps.aiProcess_GenSmoothNormals)
+MODEL_CACHE_MAGIC = b'SOTM'
+MODEL_CACHE_VERSION = 1
+
+# per instance attributes as (location, size, offset) in floats: the model
+# matrix and normal matrix columns, then the tint
+INSTANCE_SIZE = 28
+INSTANCE_ATTRIBUTES = ([(3 + column, 4, 4 * column) for column in range(4)]
+                        + [(7 + column, 3, 16 + 3 * column) for column in range(3)]
+                        + [(10, 3, 25)])
+
+# models loading ahead of load_model, by (file, isSRGB)
+_loader = ThreadPoolExecutor()
+_preloads = {}
 
 
 class Model(Mesh):
+    """ Phong lit mesh. Vertices pick their material with an optional third
+        attribute indexing materials, a list of (k_a, k_d, k_s, s) replacing
+        the single material given by k_a, k_d, k_s and s. Given instances, an
+        InstancedModel, it draws all of their copies in one call """
+    cache_directory = None  # directory of preprocessed models, when enabled
+
     def __init__(self, lights_manager, attributes, index=None,
-                    k_a=(0, 0, 0), k_d=(1, 0, 0), k_s=(1, 1, 1), s=16.0):
+                    k_a=(0, 0, 0), k_d=(1, 0, 0), k_s=(1, 1, 1), s=16.0, materials=None, instances=None):
         self.lights_manager = lights_manager
 
-        shader = Shader(VERTEX_SHADER_NAME, FRAGMENT_SHADER_NAME)
+        defines = {'NB_MAX_MATERIALS': NB_MAX_MATERIALS}
+        if instances is not None:
+            defines['INSTANCED'] = 1
+        shader = Shader.cached(VERTEX_SHADER_NAME, FRAGMENT_SHADER_NAME, defines)
         self.lights_manager.add_shader(shader)
 
         super().__init__(shader, attributes, index)
 
-        self.k_a = k_a
-        self.k_d = k_d
-        self.k_s = k_s
-        self.s = s
+        self.instances = instances
+        if instances is not None:
+            self._bind_instances(instances.instance_buffer)
+
+        materials = materials or [(k_a, k_d, k_s, s)]
+        assert len(materials) <= NB_MAX_MATERIALS, 'too many materials for one model'
+        self.k_a, self.k_d, self.k_s, self.s = (np.array(column, np.float32) for column in zip(*materials))
+        self.material = tuple(np.column_stack((self.k_a, self.k_d, self.k_s, self.s)).ravel().tolist())
 
         self.add_locations('normal_matrix', 'k_a', 'k_d', 'k_s', 's', 'w_camera_position')
 
         position = attributes[0]
         self.bounds = (np.min(position, axis=0), np.max(position, axis=0))
+        self.corners, self.shadow_texels = _box_corners(*self.bounds), None
+
+        # normal matrix of the last model matrix drawn, only updated when it changes
+        self.normal_matrix, self.normal_model = None, None
 
-    def draw(self, projection, view, model, normal_matrix, camera):
-        GL.glUseProgram(self.shader.glid)
+    @property
+    def nb_instances(self):
+        return None if self.instances is None else self.instances.nb_instances
 
-        self.lights_manager.set_uniforms(self.shader, 0)
+    def _bind_instances(self, buffer):
+        """ read the per instance attributes from the shared instance buffer """
+        gl_state.bind_vertex_array(self.vertex_array.glid)
+        GL.glBindBuffer(GL.GL_ARRAY_BUFFER, buffer)
+        for loc, size, offset in INSTANCE_ATTRIBUTES:
+            GL.glEnableVertexAttribArray(loc)
+            GL.glVertexAttribPointer(loc, size, GL.GL_FLOAT, False, 4 * INSTANCE_SIZE, ctypes.c_void_p(4 * offset))
+            GL.glVertexAttribDivisor(loc, 1)
 
-        GL.glUniformMatrix4fv(self.locations['normal_matrix'], 1, True, normal_matrix)
+    def draw(self, projection, view, model, camera):
+        gl_state.use_program(self.shader.glid)
 
-        GL.glUniform3fv(self.locations['k_a'], 1, self.k_a)
-        GL.glUniform3fv(self.locations['k_d'], 1, self.k_d)
-        GL.glUniform3fv(self.locations['k_s'], 1, self.k_s)
-        GL.glUniform1f(self.locations['s'], self.s)
+        if model is not self.normal_model:
+            self.normal_matrix, self.normal_model = normal_matrix(model), model
+        GL.glUniformMatrix4fv(self.locations['normal_matrix'], 1, True, self.normal_matrix)
+
+        if gl_state.set_material(self.material):
+            nb_materials = len(self.s)
+            GL.glUniform3fv(self.locations['k_a'], nb_materials, self.k_a)
+            GL.glUniform3fv(self.locations['k_d'], nb_materials, self.k_d)
+            GL.glUniform3fv(self.locations['k_s'], nb_materials, self.k_s)
+            GL.glUniform1fv(self.locations['s'], nb_materials, self.s)
 
         GL.glUniform3fv(self.locations['w_camera_position'], 1, camera.position)
 
-        super().draw(projection, view, model, normal_matrix, camera)
+        super().draw(projection, view, model, camera)
+
+    def shadow_key(self, model, shadow_viewproj):
+        """ shadow map texels of the bounding box, as last keyed unless it moved
+            by more than a texel, the sub-texel bob of a ship leaving the shadow map as it was """
+        self.shadow_texels = shadow_texels(shadow_viewproj @ model, self.corners, self.shadow_texels)
+        return self.shadow_texels.tobytes()
+
+
+class InstancedModel(Node):
+    """ Copies of a model file, drawn with one instanced call per packed Model
+        whatever their number. Copies are placed relative to this node and
+        tinted by set_instances, which streams them into an instance buffer
+        shared by the Models """
+    def __init__(self, file, lights_manager, isSRGB=True):
+        super().__init__()
+        self.instance_buffer = GL.glGenBuffers(1)
+        self.nb_instances = 0
+        self.transforms = np.empty((0, 4, 4), np.float32)
+        self.add(*load_model(file, lights_manager, isSRGB, instances=self))
+
+        # box, and sphere around the model origin, enclosing every vertex
+        lowers, uppers = zip(*[child.bounds for child in self.children] or [(np.zeros(3), np.zeros(3))])
+        lower, upper = np.min(lowers, axis=0), np.max(uppers, axis=0)
+        self.radius = float(np.linalg.norm(np.maximum(np.abs(lower), np.abs(upper))))
+        self.corners, self.shadow_texels = _box_corners(lower, upper), None
+
+    def set_instances(self, transforms, tints=None):
+        """ stream (N, 4, 4) transforms and optional (N, 3) colors multiplying
+            the ambient and diffuse colors, at most once per frame """
+        transforms = np.asarray(transforms, np.float32).reshape(-1, 4, 4)
+        self.transforms = transforms
+        self.nb_instances = len(transforms)
+        if self.nb_instances == 0:
+            return
+
+        # GLSL matrix attributes are read column by column, and the columns
+        # of the inverse transpose are the rows of the inverse
+        data = np.empty((self.nb_instances, INSTANCE_SIZE), np.float32)
+        data[:, :16] = transforms.transpose(0, 2, 1).reshape(-1, 16)
+        data[:, 16:25] = np.linalg.inv(transforms[:, :3, :3]).reshape(-1, 9)
+        data[:, 25:] = 1 if tints is None else tints
+
+        GL.glBindBuffer(GL.GL_ARRAY_BUFFER, self.instance_buffer)
+        GL.glBufferData(GL.GL_ARRAY_BUFFER, data, GL.GL_STREAM_DRAW)
+
+    def shadow_key(self, model, shadow_viewproj):
+        """ shadow map texels of the bounding boxes of the copies whose bounding sphere
+            touches the shadow frustum, as last keyed unless one moved by more than a texel """
+        world = self.world_matrix(model)
+        transforms = self.transforms
+        scales = np.max(np.linalg.norm(transforms[:, :3, :3], axis=1), axis=1)
+        centers = transforms[:, :3, 3] @ world[:3, :3].T + world[:3, 3]
+        radii = (self.radius * np.max(np.linalg.norm(world[:3, :3], axis=0)) * scales)[:, np.newaxis]
+        visible = boxes_in_frustum(frustum_planes(shadow_viewproj), centers - radii, centers + radii)
+        self.shadow_texels = shadow_texels(shadow_viewproj @ world @ transforms[visible], self.corners,
+                                            self.shadow_texels)
+        return self.shadow_texels.tobytes()
+
+    def __del__(self):
+        GL.glDeleteBuffers(1, [self.instance_buffer])
+
+
+def _box_corners(lower, upper):
+    """ homogeneous coordinates of the 8 corners of a box, one per row """
+    return np.array([(x, y, z, 1) for x in (lower[0], upper[0])
+                        for y in (lower[1], upper[1]) for z in (lower[2], upper[2])])
+
+
+def set_model_cache(directory):
+    """ save imported models in directory and memory map them on later runs """
+    os.makedirs(directory, exist_ok=True)
+    Model.cache_directory = directory
+
+
+def preload_models(*files, isSRGB=True):
+    """ start loading files in background threads, for load_model to pick up """
+    for file in files:
+        if (file, isSRGB) not in _preloads:
+            _preloads[file, isSRGB] = _loader.submit(_load_arrays, file, isSRGB)
+
+
+def load_model(file, lights_manager, isSRGB=True, merge=True, instances=None):
+    """ load resources from file using assimp, return list of Model, packing
+        submeshes NB_MAX_MATERIALS at a time into single Models unless merge is False,
+        and drawing the copies of instances when given """
+    future = _preloads.pop((file, isSRGB), None)
+    arrays = future.result() if future else _load_arrays(file, isSRGB)
+    if arrays is None:
+        return []
+
+    nb_submeshes = len(arrays['materials'])
+    step = NB_MAX_MATERIALS if merge else 1
+    return [_model(lights_manager, arrays, first, min(first + step, nb_submeshes), instances)
+            for first in range(0, nb_submeshes, step)]
+
+
+def _model(lights_manager, arrays, first, last, instances=None):
+    """ Model drawing submeshes first to last - 1 of packed arrays in one call """
+    vertex_starts, index_starts = arrays['vertex_starts'], arrays['index_starts']
+    vertices = slice(vertex_starts[first], vertex_starts[last])
+    indices = slice(index_starts[first], index_starts[last])
+
+    # memory mapped slices go to the GPU as they are, only later chunks need rebasing
+    submesh, index = arrays['submesh'][vertices], arrays['index'][indices]
+    if first > 0:
+        submesh, index = submesh - first, index - vertex_starts[first]
+
+    materials = [(m[0:3], m[3:6], m[6:9], m[9]) for m in arrays['materials'][first:last]]
+    return Model(lights_manager, [arrays['position'][vertices], arrays['normal'][vertices], submesh],
+                    index, materials=materials, instances=instances)
 
 
-def load_model(file, lights_manager, isSRGB=True):
-    """ load resources from file using assimp, return list of Model """
+def _load_arrays(file, isSRGB):
+    """ packed arrays of file, from the model cache when enabled and up to date """
+    if Model.cache_directory is None:
+        return _import_arrays(file, isSRGB)
+
+    try:
+        with open(file, 'rb') as source:
+            key = hashlib.sha1(source.read())
+    except OSError:
+        return _import_arrays(file, isSRGB)  # reports the error
+    key.update('{} {} {}'.format(MODEL_CACHE_VERSION, int(IMPORT_FLAGS), isSRGB).encode())
+    filename = os.path.join(Model.cache_directory, key.hexdigest() + '.model')
+
+    arrays = _read_cache(filename)
+    if arrays is None:
+        arrays = _import_arrays(file, isSRGB)
+        if arrays is not None:
+            _write_cache(filename, arrays)
+    return arrays
+
+
+def _import_arrays(file, isSRGB):
+    """ import file with assimp and pack its submeshes one after the other:
+        position, normal, submesh number per vertex, index into the packed
+        vertices, (k_a, k_d, k_s, s) rows of materials, and where each submesh
+        starts in vertices and indices """
     toLinearRGB = lambda color: np.power(color, 2.2) if isSRGB else color
 
     try:
-        pp = assimpcy.aiPostProcessSteps
-        flags = pp.aiProcess_Triangulate | pp.aiProcess_GenSmoothNormals
-        scene = assimpcy.aiImportFile(file, flags)
+        scene = assimpcy.aiImportFile(file, IMPORT_FLAGS)
     except assimpcy.all.AssimpError as exception:
         print('Error: loading \'{}\': {}'.format(file, exception.args[0].decode()))
-        return []
+        return None
 
-    # prepare model nodes
-    models = []
-    for mesh in scene.mMeshes:
+    positions, normals, submeshes, indices, materials = [], [], [], [], []
+    vertex_starts, index_starts = [0], [0]
+    for number, mesh in enumerate(scene.mMeshes):
         mat = scene.mMaterials[mesh.mMaterialIndex].properties
-        model = Model(lights_manager, [mesh.mVertices, mesh.mNormals], mesh.mFaces,
-                        k_a=toLinearRGB(mat.get('COLOR_AMBIENT', (0, 0, 0))),
-                        k_d=toLinearRGB(mat.get('COLOR_DIFFUSE', (1, 0, 0))),
-                        k_s=toLinearRGB(mat.get('COLOR_SPECULAR', (0.5, 0.5, 0.5))),
-                        s=mat.get('SHININESS', 16.))
-        models.append(model)
-
-    return models
+        materials.append(np.concatenate((toLinearRGB(mat.get('COLOR_AMBIENT', (0, 0, 0))),
+                                            toLinearRGB(mat.get('COLOR_DIFFUSE', (1, 0, 0))),
+                                            toLinearRGB(mat.get('COLOR_SPECULAR', (0.5, 0.5, 0.5))),
+                                            (mat.get('SHININESS', 16.),))))
+
+        nb_vertices = len(mesh.mVertices)
+        positions.append(mesh.mVertices)
+        normals.append(mesh.mNormals)
+        submeshes.append(np.full((nb_vertices, 1), number))
+        indices.append(np.asarray(mesh.mFaces, np.uint32).ravel() + vertex_starts[-1])
+        vertex_starts.append(vertex_starts[-1] + nb_vertices)
+        index_starts.append(index_starts[-1] + indices[-1].size)
+
+    if not materials:
+        return None
+
+    return {'position': np.concatenate(positions).astype(np.float32),
+            'normal': np.concatenate(normals).astype(np.float32),
+            'submesh': np.concatenate(submeshes).astype(np.float32),
+            'index': np.concatenate(indices),
+            'materials': np.array(materials, np.float32),
+            'vertex_starts': np.array(vertex_starts, np.int64),
+            'index_starts': np.array(index_starts, np.int64)}
+
+
+# Model cache file: magic, version and header size, a JSON header giving the
+# dtype, shape and offset of every array, then the raw arrays
+MODEL_CACHE_HEADER = struct.Struct('<4sII')
+MODEL_CACHE_HEADER_SIZE = 4096
+
+
+def _read_cache(filename):
+    """ arrays memory mapped from a cache file, None if missing or outdated """
+    try:
+        with open(filename, 'rb') as file:
+            magic, version, size = MODEL_CACHE_HEADER.unpack(file.read(MODEL_CACHE_HEADER.size))
+            if magic != MODEL_CACHE_MAGIC or version != MODEL_CACHE_VERSION:
+                return None
+            layout = json.loads(file.read(size))
+        return {name: np.memmap(filename, dtype, 'r', offset, tuple(shape))
+                for name, (dtype, shape, offset) in layout.items()}
+    except (OSError, ValueError, struct.error):
+        return None
+
+
+def _write_cache(filename, arrays):
+    # the header lists the array offsets, which follow it: reserve it whole
+    # blocks of MODEL_CACHE_HEADER_SIZE bytes, more of them until it fits
+    header_size = MODEL_CACHE_HEADER_SIZE
+    while True:
+        layout, offset = {}, MODEL_CACHE_HEADER.size + header_size
+        for name, array in arrays.items():
+            layout[name] = (array.dtype.str, array.shape, offset)
+            offset += -(-array.nbytes // 64) * 64
+        header = json.dumps(layout).encode()
+        if len(header) <= header_size:
+            break
+        header_size = -(-len(header) // MODEL_CACHE_HEADER_SIZE) * MODEL_CACHE_HEADER_SIZE
+    header = header.ljust(header_size)
+
+    try:
+        temporary = filename + '.{}.tmp'.format(os.getpid())
+        with open(temporary, 'wb') as file:
+            file.write(MODEL_CACHE_HEADER.pack(MODEL_CACHE_MAGIC, MODEL_CACHE_VERSION, len(header)))
+            file.write(header)
+            for name, array in arrays.items():
+                file.seek(layout[name][2])
+                file.write(np.ascontiguousarray(array).tobytes())
+        os.replace(temporary, filename)
+    except OSError as exception:
+        print('Warning: unable to save model cache \'{}\': {}'.format(filename, exception))
@@ -2,21 +2,44 @@
 
 layout(location = 0) in vec3 position;
 layout(location = 1) in vec3 normal;
+layout(location = 2) in float material;
+#ifdef INSTANCED
+// per instance, relative to the model matrix: locations 3 to 6, 7 to 9 and 10
+layout(location = 3) in mat4 instance_model;
+layout(location = 7) in mat3 instance_normal_matrix;
+layout(location = 10) in vec3 instance_tint;
+#endif
 
 uniform mat4 model, view, projection;
 uniform mat4 normal_matrix;
-uniform mat4 shadow_viewproj;
+
+layout(std140, row_major) uniform Shadow {
+    mat4 shadow_viewproj;
+};
 
 out vec3 w_position;
 out vec3 w_normal;
 out vec3 shadow_frag_pos;
+flat out int material_index;
+flat out vec3 tint;
 
 void main() {
+#ifdef INSTANCED
+    vec4 model_position = model * instance_model * vec4(position, 1.0);
+    vec3 model_normal = mat3(normal_matrix) * instance_normal_matrix * normal;
+    tint = instance_tint;
+#else
     vec4 model_position = model * vec4(position, 1.0);
+    vec3 model_normal = vec3(normal_matrix * vec4(normal, 0.0));
+    tint = vec3(1.0);
+#endif
     w_position = vec3(model_position) / model_position.w;
     gl_Position = projection * view * model_position;
 
-    w_normal = normalize(vec3(normal_matrix * vec4(normal, 0.0)));
+    w_normal = normalize(model_normal);
 
     shadow_frag_pos = vec3(shadow_viewproj * vec4(w_position, 1.0));
+
+    // a disabled material attribute reads as 0, the first material
+    material_index = int(material);
 }
@@ -7,6 +7,7 @@ from core.keyframes import KeyFrameControlNode
 
 OFFICER_NAME = '../assets/models/pirate_officer.obj'
 OFFICER_PERIOD = 30
+OFFICER_BAKE_RATE = 60
 OFFICER_TRANSLATE = {0: vec(0, 23.15, 14),
                         4: vec(0, 23.15, 14),
                         5: vec(0, 23.15, 18),
@@ -36,7 +37,8 @@ OFFICER_SCALE = {0: 1}
 
 class Officer(KeyFrameControlNode):
     def __init__(self, lights_manager):
-        super().__init__(OFFICER_TRANSLATE, OFFICER_ROTATE, OFFICER_SCALE, OFFICER_PERIOD)
+        super().__init__(OFFICER_TRANSLATE, OFFICER_ROTATE, OFFICER_SCALE, OFFICER_PERIOD,
+                            bake_rate=OFFICER_BAKE_RATE)
 
         officer = load_model(OFFICER_NAME, lights_manager)
         self.add(*officer)
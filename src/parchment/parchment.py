@@ -3,7 +3,9 @@
 import OpenGL.GL as GL
 import glfw
 
+from core.gl_state import gl_state
 from core.node import Node
+from core.render_queue import OVERLAY
 from core.shader import Shader
 from core.mesh import Mesh
 from core.texture import Texture
@@ -18,7 +20,7 @@ class Parchment(Node):
     def __init__(self):
         super().__init__()
 
-        shader = Shader(VERTEX_SHADER_NAME, FRAGMENT_SHADER_NAME)
+        shader = Shader.cached(VERTEX_SHADER_NAME, FRAGMENT_SHADER_NAME)
         position = [(-SIZE, -SIZE), (SIZE, -SIZE), (SIZE, SIZE), (-SIZE, SIZE)]
         tex_coords = [(0.0, 1.0), (1.0, 1.0), (1.0, 0.0), (0.0, 0.0)]
         index = [0, 1, 2, 0, 2, 3]
@@ -31,18 +33,26 @@ class Parchment(Node):
         self.hidden = False
         self.keystates = {}
 
-    def draw(self, projection, view, model, normal_matrix, camera):
-        super().draw(projection, view, model, normal_matrix, camera)
+    def draw(self, projection, view, model, camera):
+        super().draw(projection, view, model, camera)
 
-        if self.hidden:
-            return
+        if not self.hidden:
+            self._draw_overlay(projection, view, model, camera)
+
+    def queue(self, render_queue, projection, view, model, camera):
+        super().queue(render_queue, projection, view, model, camera)
+
+        if not self.hidden:
+            render_queue.add(lambda: self._draw_overlay(projection, view, model, camera),
+                                self.mesh.shader.glid, (self.texture.glid,), group=OVERLAY, name='Parchment')
 
-        GL.glUseProgram(self.mesh.shader.glid)
+    def _draw_overlay(self, projection, view, model, camera):
+        gl_state.use_program(self.mesh.shader.glid)
 
         self.texture.bind(0)
         GL.glUniform1i(self.mesh.locations['tex'], 0)
 
-        self.mesh.draw(projection, view, model, normal_matrix, camera)
+        self.mesh.draw(projection, view, model, camera)
 
     def key_handler(self, key, is_press):
         self.keystates[key] = is_press
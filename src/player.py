@@ -15,8 +15,7 @@ SHIP_SPEED = 4
 SHIP_ANGULAR_VELOCITY = 75
 HEIGHT_DEFAULT = -0.25
 HEIGHT_WATER_SCALING = 0.25
-HEIGHT_DIRECTION_BIAIS = -0.25
-ROLL_SCALING = 0.5
+HULL_SAMPLES = 8
 
 
 class Player(Node):
@@ -35,8 +34,12 @@ class Player(Node):
         self.diagonal = self.bounds[1] - self.bounds[0]
         self.local_center = sum(self.bounds) / 2
 
+        # grid of hull points, as distances along the ship length and width
+        lengths = np.linspace(-self.diagonal[2] / 2, self.diagonal[2] / 2, HULL_SAMPLES)
+        widths = np.linspace(-self.diagonal[0] / 2, self.diagonal[0] / 2, HULL_SAMPLES)
+        self.hull_lengths, self.hull_widths = (grid.ravel() for grid in np.meshgrid(lengths, widths))
+
         self.position = vec(0, 0, 0)
-        self.roll_time = 0
         self.speed = 0
         self.angle = SHIP_DEFAULT_ANGLE
         self.angular_velocity = [0, 0]
@@ -50,15 +53,14 @@ class Player(Node):
 
         self.position += delta_time * self.speed * direction
 
-        x, _, z = self.position - (self.diagonal[2] / 2 + HEIGHT_DIRECTION_BIAIS) * direction
-        height = HEIGHT_DEFAULT + HEIGHT_WATER_SCALING * self.water.height(x, z)
+        height, pitch, roll = self._buoyancy(direction, vec(sin_angle, 0, cos_angle))
 
         translation = translate(self.position + vec(0, height, 0))
 
-        rolling = rotate((0, 0, 1), ROLL_SCALING * periodic(self.roll_time))
-        self.roll_time += delta_time
+        tilt = rotate((0, 0, 1), roll) @ rotate((1, 0, 0), pitch)
+        tilt = translate(self.local_center) @ tilt @ translate(-self.local_center)
 
-        self.set_transform(translation @ rotation @ rolling @ scale(self.scaling))
+        self.set_transform(translation @ rotation @ tilt @ scale(self.scaling))
 
         super().update(delta_time)
 
@@ -72,12 +74,19 @@ class Player(Node):
 
         super().key_handler(key, is_press)
 
+    def _buoyancy(self, direction, side):
+        """ heave, pitch and roll (degrees) from a plane fitted to the water under the hull """
+        x, _, z = self.position + self.local_center
+        self.water.prefetch(x, z, np.linalg.norm(self.diagonal[[0, 2]]) / 2)
 
-def smoothstep(x):
-    return x * x * (3 - 2 * x)
+        xs = x + self.hull_lengths * direction[0] + self.hull_widths * side[0]
+        zs = z + self.hull_lengths * direction[2] + self.hull_widths * side[2]
+        heights = HEIGHT_WATER_SCALING * self.water.heights(xs, zs)
 
+        # least squares slopes, the sample grid being centered on the hull
+        pitch_slope = np.dot(heights, self.hull_lengths) / np.dot(self.hull_lengths, self.hull_lengths)
+        roll_slope = np.dot(heights, self.hull_widths) / np.dot(self.hull_widths, self.hull_widths)
 
-def periodic(x):
-    x = x % 2
-    y = smoothstep(x) if x < 1 else smoothstep(2 - x)
-    return 2 * y - 1
+        return (HEIGHT_DEFAULT + np.mean(heights),
+                np.degrees(np.arctan(pitch_slope)),
+                np.degrees(np.arctan(roll_slope)))
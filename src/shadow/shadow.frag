@@ -0,0 +1,5 @@
+#version 330 core
+
+// depth only, nothing to shade
+void main() {
+}
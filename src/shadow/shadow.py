@@ -0,0 +1,46 @@
+#!/usr/bin/env python3
+
+import OpenGL.GL as GL
+import numpy as np
+
+from core.gl_state import gl_state
+from core.shader import Shader
+
+
+VERTEX_SHADER_NAME = 'shadow/shadow.vert'
+FRAGMENT_SHADER_NAME = 'shadow/shadow.frag'
+SHADOW_WIDTH, SHADOW_HEIGHT = 1024, 1024
+SHADOW_KEY_TOLERANCE = 1  # texels a caster moves before its shadow is rendered again
+
+
+class ShadowCaster:
+    """ Depth only programs shared by every mesh drawn into a shadow map, the
+        instanced variant reading per instance model matrices like model.vert """
+    def __init__(self):
+        self.shader = Shader.cached(VERTEX_SHADER_NAME, FRAGMENT_SHADER_NAME)
+        self.instanced_shader = Shader.cached(VERTEX_SHADER_NAME, FRAGMENT_SHADER_NAME, {'INSTANCED': 1})
+        names = ['model', 'shadow_viewproj']
+        self.locations = {shader: {name: GL.glGetUniformLocation(shader.glid, name) for name in names}
+                            for shader in (self.shader, self.instanced_shader)}
+
+    def use(self, shadow_viewproj):
+        self.viewproj = shadow_viewproj  # for casters culling themselves
+        for shader in (self.instanced_shader, self.shader):
+            gl_state.use_program(shader.glid)
+            GL.glUniformMatrix4fv(self.locations[shader]['shadow_viewproj'], 1, True, shadow_viewproj)
+
+    def draw(self, vertex_array, model, nb_instances=None):
+        shader = self.shader if nb_instances is None else self.instanced_shader
+        gl_state.use_program(shader.glid)
+        GL.glUniformMatrix4fv(self.locations[shader]['model'], 1, True, model)
+        vertex_array.execute(GL.GL_TRIANGLES, nb_instances)
+
+
+def shadow_texels(matrices, corners, keyed=None):
+    """ shadow map texels of the (8, 4) homogeneous box corners moved by the
+        model to shadow clip space matrices, or keyed, the texels of the last
+        shadow key, if no corner moved by more than SHADOW_KEY_TOLERANCE since """
+    texels = corners @ np.swapaxes(matrices, -1, -2) * (SHADOW_WIDTH / 2, SHADOW_HEIGHT / 2, SHADOW_WIDTH / 2, 1)
+    if keyed is not None and keyed.shape == texels.shape and np.all(np.abs(texels - keyed) <= SHADOW_KEY_TOLERANCE):
+        return keyed
+    return texels
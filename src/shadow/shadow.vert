@@ -0,0 +1,17 @@
+#version 330 core
+
+layout(location = 0) in vec3 position;
+#ifdef INSTANCED
+layout(location = 3) in mat4 instance_model;  // per instance, locations 3 to 6
+#endif
+
+uniform mat4 model;
+uniform mat4 shadow_viewproj;
+
+void main() {
+#ifdef INSTANCED
+    gl_Position = shadow_viewproj * model * instance_model * vec4(position, 1.0);
+#else
+    gl_Position = shadow_viewproj * model * vec4(position, 1.0);
+#endif
+}
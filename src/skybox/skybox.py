@@ -2,6 +2,8 @@
 
 import OpenGL.GL as GL
 
+from core.gl_state import gl_state
+from core.render_queue import BACKGROUND
 from core.shader import Shader
 from core.mesh import Mesh
 from core.texture import Cubemap
@@ -10,16 +12,16 @@ from core.transform import identity, rotate
 
 VERTEX_SHADER_NAME = 'skybox/skybox.vert'
 FRAGMENT_SHADER_NAME = 'skybox/skybox.frag'
-TEXTURES_BACK_NAME = ('../assets/skybox/back/{}.png'.format(name)
-                        for name in ('side', 'side', 'top', 'top', 'front', 'side'))
-TEXTURES_FRONT_NAME = ('../assets/skybox/front/{}.png'.format(name)
-                        for name in ('right', 'left', 'top', 'top', 'front', 'back'))
+TEXTURES_BACK_NAME = tuple('../assets/skybox/back/{}.png'.format(name)
+                            for name in ('side', 'side', 'top', 'top', 'front', 'side'))
+TEXTURES_FRONT_NAME = tuple('../assets/skybox/front/{}.png'.format(name)
+                            for name in ('right', 'left', 'top', 'top', 'front', 'back'))
 CLOUDS_ANGULAR_VELOCITY = 0.5
 
 
 class Skybox(Mesh):
     def __init__(self):
-        shader = Shader(VERTEX_SHADER_NAME, FRAGMENT_SHADER_NAME)
+        shader = Shader.cached(VERTEX_SHADER_NAME, FRAGMENT_SHADER_NAME)
 
         position = [(1.0, -1.0, 1.0), (1.0, -1.0, -1.0), (1.0, 1.0, -1.0), (1.0, 1.0, 1.0),
                     (-1.0, -1.0, -1.0), (-1.0, 1.0, -1.0), (-1.0, 1.0, 1.0), (-1.0, -1.0, 1.0)]
@@ -36,6 +38,7 @@ class Skybox(Mesh):
 
         self.back = Cubemap(*TEXTURES_BACK_NAME)
         self.front = Cubemap(*TEXTURES_FRONT_NAME)
+        self.material = (self.back.glid, self.front.glid)
 
         self.angle = 0
         self.rotation = identity()
@@ -44,12 +47,16 @@ class Skybox(Mesh):
         self.angle += CLOUDS_ANGULAR_VELOCITY * delta_time
         self.rotation = rotate((0, 1, 0), -self.angle)
 
-    def draw(self, projection, view, model, normal_matrix, camera):
-        GL.glUseProgram(self.shader.glid)
+    def queue(self, render_queue, projection, view, model, camera):
+        render_queue.add(lambda: self.draw(projection, view, model, camera),
+                            self.shader.glid, self.material, group=BACKGROUND, name='Skybox')
+
+    def draw(self, projection, view, model, camera):
+        gl_state.use_program(self.shader.glid)
 
         self.back.bind(0)
         GL.glUniform1i(self.locations['tex_back'], 0)
         self.front.bind(1)
         GL.glUniform1i(self.locations['tex_front'], 1)
 
-        super().draw(projection, view, self.rotation, self.rotation, camera)
+        super().draw(projection, view, self.rotation, camera)
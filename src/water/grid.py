@@ -0,0 +1,96 @@
+#!/usr/bin/env python3
+
+import numpy as np
+
+
+# Grids are built row by row along z. Each grid column of a row is a pair of
+# vertices (x, z) and (x, z + 1), rows listing their own vertices so that a
+# row of any extent is a single run of quads. Heights and normals are read
+# from the heightmap in the vertex shader, vertices only carry (x, z).
+
+def rows(z, x_first, x_last):
+    """ vertex pairs and quads of grid rows, row k spanning x_first[k]..x_last[k] at z[k] """
+    z, x_first, x_last = np.broadcast_arrays(z, x_first, x_last)
+
+    # one vertex pair per grid column, rows laid out one after the other
+    nb_pairs = x_last - x_first + 1
+    row_starts = np.cumsum(nb_pairs) - nb_pairs
+    pair_z = np.repeat(z, nb_pairs)
+    pair_x = np.arange(nb_pairs.sum()) - np.repeat(row_starts - x_first, nb_pairs)
+
+    position = np.empty((pair_x.size, 2, 2), np.float32)
+    position[:, :, 0] = pair_x[:, np.newaxis]
+    position[:, 0, 1] = pair_z
+    position[:, 1, 1] = pair_z + 1
+
+    # two triangles between each pair and the next one in the same row
+    quads = np.delete(np.arange(pair_x.size), row_starts + nb_pairs - 1)
+    index = 2 * quads[:, np.newaxis].astype(np.uint32) + np.array((1, 3, 0, 2, 0, 3), np.uint32)
+
+    return position.reshape(-1, 2), index.ravel()
+
+
+def rectangle(width, depth):
+    """ grid of width x depth unit quads with a corner at the origin """
+    return rows(np.arange(depth), 0, width)
+
+
+# Geometry clipmap
+# from "Geometry Clipmaps: Terrain Rendering Using Nested Regular Grids"
+# by Frank Losasso and Hugues Hoppe, GPU Gems 2, chapter 2.
+#
+# Level l is a square of 4m - 2 cells of size 2^l: a ring of 12 blocks of
+# (m - 1)^2 cells, 4 fix-ups 2 cells wide between them, and an L-shaped trim
+# 1 cell wide filling the gap left around the finer level. Level 0 has a
+# center square of 2m cells instead of the finer level.
+
+def clipmap_shapes(m):
+    """ (width, depth) in cells of every patch shape of a clipmap """
+    return {'block': (m - 1, m - 1),
+            'fixup_x': (2, m - 1),
+            'fixup_z': (m - 1, 2),
+            'trim_x': (1, 2 * m),
+            'trim_z': (2 * m - 1, 1),
+            'center': (2 * m, 2 * m)}
+
+
+def clipmap_corners(x, z, m, nb_levels):
+    """ lowest (x, z) corner of every level of a clipmap centered on (x, z) """
+    cell_sizes = 2.0 ** np.arange(nb_levels)[:, np.newaxis]
+    # corner on the grid of the next coarser level, camera within one cell of the center
+    return 2 * cell_sizes * np.floor(np.array((x, z)) / (2 * cell_sizes)) - (2 * m - 2) * cell_sizes
+
+
+def clipmap_instances(x, z, m, nb_levels):
+    """ patches of a clipmap centered on (x, z), as (origin x, origin z, cell size, level)
+        instances for each shape of clipmap_shapes """
+    instances = {name: [] for name in clipmap_shapes(m)}
+    blocks = (0, m - 1, 2 * m, 3 * m - 1)
+    ring = [(i, j) for i in blocks for j in blocks if blocks[0] in (i, j) or blocks[3] in (i, j)]
+
+    for level, (corner_x, corner_z) in enumerate(clipmap_corners(x, z, m, nb_levels)):
+        cell_size = 2 ** level
+
+        def add(name, i, j):
+            instances[name].append((corner_x + i * cell_size, corner_z + j * cell_size, cell_size, level))
+
+        for i, j in ring:
+            add('block', i, j)
+        for j in (blocks[0], blocks[3]):
+            add('fixup_x', 2 * m - 2, j)
+        for i in (blocks[0], blocks[3]):
+            add('fixup_z', i, 2 * m - 2)
+
+        if level == 0:
+            add('center', m - 1, m - 1)
+            continue
+
+        # the finer level sits one cell off the center of the hole, on the side of the camera
+        odd_x = int(np.floor(x / cell_size)) % 2
+        odd_z = int(np.floor(z / cell_size)) % 2
+        trim_x = m - 1 if odd_x else 3 * m - 2
+        trim_z = m - 1 if odd_z else 3 * m - 2
+        add('trim_x', trim_x, m - 1)
+        add('trim_z', m if odd_x else m - 1, trim_z)
+
+    return {name: np.array(patches, np.float32).reshape(-1, 4) for name, patches in instances.items()}
@@ -0,0 +1,154 @@
+#!/usr/bin/env python3
+
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+import multiprocessing
+
+import numpy as np
+
+from water.noise import vec3, noise
+
+
+TILE_SIZE = 8
+TILE_RESOLUTION = 64
+TIME_STEP = 0.125
+# samples sit off the simplex lattice, in cells and time steps: the noise
+# floors and steps tie on lattice points, where it spikes away from its
+# neighbourhood, and interpolation would spread the spikes over whole cells
+SAMPLE_OFFSET = 0.381966
+TIME_OFFSET = 0.618034
+PREFETCH_SLICES = 4
+MEMORY_LIMIT = 64 * 1024 * 1024
+
+
+def generate_tile(key, tile_size, resolution, time_step, position_scaling, time_scaling):
+    """ heights of a (resolution + 1)^2 grid covering one tile at one time slice,
+        both shifted by their sample offsets, rows along z """
+    tile_x, tile_z, time_index = key
+    samples = (np.arange(resolution + 1) + SAMPLE_OFFSET) / resolution
+    xs, zs = np.meshgrid(tile_size * (tile_x + samples), tile_size * (tile_z + samples))
+    time = time_step * (time_index + TIME_OFFSET)
+    heights = noise(vec3(position_scaling * xs, position_scaling * zs, time_scaling * time))
+    return heights.astype(np.float32)
+
+
+class HeightfieldCache:
+    """ Water heights precomputed on tiles of a regular (x, z) grid at regular time slices,
+        queried by trilinear interpolation and generated ahead of need in a process pool """
+    def __init__(self, position_scaling, time_scaling, tile_size=TILE_SIZE, resolution=TILE_RESOLUTION,
+                    time_step=TIME_STEP, memory_limit=MEMORY_LIMIT, max_workers=None):
+        self.parameters = (tile_size, resolution, time_step, position_scaling, time_scaling)
+        self.tile_size = tile_size
+        self.resolution = resolution
+        self.time_step = time_step
+
+        tile_bytes = (resolution + 1) * (resolution + 1) * np.dtype(np.float32).itemsize
+        self.max_tiles = max(memory_limit // tile_bytes, 8 * (PREFETCH_SLICES + 1))
+
+        # tiles stacked in one array, gathered from in one indexing per query
+        self.slots = np.empty((self.max_tiles, resolution + 1, resolution + 1), np.float32)
+        self.tiles = OrderedDict()  # key to slot, least recently used first
+        self.pending = {}
+        self.max_workers = max_workers
+        self.executor = None
+
+    def heights(self, xs, zs, time):
+        """ interpolated heights at (x, z) positions of any shape, evaluated
+            directly where a tile is still being generated in the pool """
+        self._collect()
+
+        xs, zs = np.broadcast_arrays(np.asarray(xs, dtype=float), np.asarray(zs, dtype=float))
+        shape = xs.shape
+        xs, zs = xs.ravel(), zs.ravel()
+        if xs.size == 0:
+            return np.empty(shape)
+
+        # positions in grid cells, split into tile, cell and fraction
+        cell_size = self.tile_size / self.resolution
+        u, v = xs / cell_size - SAMPLE_OFFSET, zs / cell_size - SAMPLE_OFFSET
+        tile_u, tile_v = np.floor(u / self.resolution), np.floor(v / self.resolution)
+        u, v = u - tile_u * self.resolution, v - tile_v * self.resolution
+        iu = np.minimum(u.astype(int), self.resolution - 1)
+        iv = np.minimum(v.astype(int), self.resolution - 1)
+        fu, fv = u - iu, v - iv
+
+        slice_time = time / self.time_step - TIME_OFFSET
+        time_index = int(np.floor(slice_time))
+        ft = slice_time - time_index
+
+        # slots of the few tiles touched, numbered in their bounding rectangle,
+        # at both time slices, then of every position
+        first_u, first_v, width = tile_u.min(), tile_v.min(), tile_u.max() - tile_u.min() + 1
+        cells, inverse = np.unique(((tile_v - first_v) * width + tile_u - first_u).astype(int), return_inverse=True)
+        tiles = [(int(first_u) + cell % int(width), int(first_v) + cell // int(width)) for cell in cells.tolist()]
+        slots = np.array([[self._slot((tile_x, tile_z, time_slice)) for tile_x, tile_z in tiles]
+                            for time_slice in (time_index, time_index + 1)])[:, inverse]
+
+        # the four cell corners at both time slices, in one gather
+        row = self.resolution + 1
+        first = (slots * row + iv) * row + iu
+        corners = self.slots.reshape(-1).take(first[..., np.newaxis] + (0, 1, row, row + 1))
+        h00, h10, h01, h11 = corners.transpose(2, 0, 1)
+        h0 = h00 + fu * (h10 - h00)
+        h1 = h01 + fu * (h11 - h01)
+        before, after = h0 + fv * (h1 - h0)
+        result = before + ft * (after - before)
+
+        pending = (slots < 0).any(axis=0)
+        if pending.any():
+            _, _, _, position_scaling, time_scaling = self.parameters
+            result[pending] = noise(vec3(position_scaling * xs[pending], position_scaling * zs[pending],
+                                         time_scaling * time))
+
+        return result.reshape(shape)
+
+    def prefetch(self, x, z, radius, time):
+        """ queue generation of the tiles within radius of (x, z) for the upcoming time slices """
+        self._collect()
+
+        if self.executor is None:
+            context = multiprocessing.get_context('spawn')
+            self.executor = ProcessPoolExecutor(self.max_workers, mp_context=context)
+
+        size = self.tile_size
+        x, z = (coordinate - SAMPLE_OFFSET * size / self.resolution for coordinate in (x, z))
+        tiles_x = range(int(np.floor((x - radius) / size)), int(np.floor((x + radius) / size)) + 1)
+        tiles_z = range(int(np.floor((z - radius) / size)), int(np.floor((z + radius) / size)) + 1)
+        time_index = int(np.floor(time / self.time_step - TIME_OFFSET))
+        for time_slice in range(time_index, time_index + PREFETCH_SLICES + 1):
+            for tile_z in tiles_z:
+                for tile_x in tiles_x:
+                    key = (tile_x, tile_z, time_slice)
+                    if key not in self.tiles and key not in self.pending:
+                        self.pending[key] = self.executor.submit(generate_tile, key, *self.parameters)
+
+    def _slot(self, key):
+        """ slot of the tile, generated synchronously if not prefetched,
+            or -1 while the process pool is still generating it """
+        slot = self.tiles.get(key)
+        if slot is not None:
+            self.tiles.move_to_end(key)
+            return slot
+        if key in self.pending:
+            return -1
+        return self._store(key, generate_tile(key, *self.parameters))
+
+    def _collect(self):
+        """ move finished tiles from the process pool into the cache """
+        done = [key for key, future in self.pending.items() if future.done()]
+        for key in done:
+            self._store(key, self.pending.pop(key).result())
+
+    def _store(self, key, heights):
+        """ copy the tile into the least recently used slot, return the slot """
+        if len(self.tiles) < self.max_tiles:
+            slot = len(self.tiles)
+        else:
+            _, slot = self.tiles.popitem(last=False)
+        self.slots[slot] = heights
+        self.tiles[key] = slot
+        return slot
+
+    def __del__(self):
+        if self.executor is not None:
+            self.executor.shutdown(wait=False, cancel_futures=True)
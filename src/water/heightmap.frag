@@ -0,0 +1,140 @@
+#version 330 core
+
+#define POSITION_SCALING_FACTOR 0.25
+#define TIME_SCALING_FACTOR 0.25
+
+uniform float time;
+
+uniform vec2 origin;      // world (x, z) of texel (0, 0)
+uniform float cell_size;  // world distance between texels
+
+out vec4 height_normal;
+
+/** Simplex Noise, with its analytic gradient
+ * from "Efficient computational noise in GLSL" by Ian McEwan et al.
+ * https://github.com/ashima/webgl-noise/blob/master/src/noise3Dgrad.glsl
+ */
+
+vec3 mod289(vec3 x) {
+    return x - floor(x * (1.0 / 289.0)) * 289.0;
+}
+
+vec4 mod289(vec4 x) {
+    return x - floor(x * (1.0 / 289.0)) * 289.0;
+}
+
+vec4 permute(vec4 x) {
+    return mod289(((x * 34.0) + 1.0) * x);
+}
+
+vec4 taylorInvSqrt(vec4 r)
+{
+    return 1.79284291400159 - 0.85373472095314 * r;
+}
+
+float snoise(vec3 v, out vec3 gradient)
+{
+    const vec2 C = vec2(1.0 / 6.0, 1.0 / 3.0);
+    const vec4 D = vec4(0.0, 0.5, 1.0, 2.0);
+
+    // First corner
+    vec3 i = floor(v + dot(v, C.yyy));
+    vec3 x0 = v - i + dot(i, C.xxx);
+
+    // Other corners
+    vec3 g = step(x0.yzx, x0.xyz);
+    vec3 l = 1.0 - g;
+    vec3 i1 = min(g.xyz, l.zxy);
+    vec3 i2 = max(g.xyz, l.zxy);
+
+    vec3 x1 = x0 - i1 + C.xxx;
+    vec3 x2 = x0 - i2 + C.yyy;
+    vec3 x3 = x0 - D.yyy;
+
+    // Permutations
+    i = mod289(i);
+    vec4 p = permute(permute(permute(
+            i.z + vec4(0.0, i1.z, i2.z, 1.0))
+            + i.y + vec4(0.0, i1.y, i2.y, 1.0))
+            + i.x + vec4(0.0, i1.x, i2.x, 1.0));
+
+    // Gradients: 7x7 points over a square, mapped onto an octahedron.
+    // The ring size 17*17 = 289 is close to a multiple of 49 (49*6 = 294)
+    float n_ = 0.142857142857;
+    vec3 ns = n_ * D.wyz - D.xzx;
+
+    vec4 j = p - 49.0 * floor(p * ns.z * ns.z);
+
+    vec4 x_ = floor(j * ns.z);
+    vec4 y_ = floor(j - 7.0 * x_);
+
+    vec4 x = x_ * ns.x + ns.yyyy;
+    vec4 y = y_ * ns.x + ns.yyyy;
+    vec4 h = 1.0 - abs(x) - abs(y);
+
+    vec4 b0 = vec4(x.xy, y.xy);
+    vec4 b1 = vec4(x.zw, y.zw);
+
+    vec4 s0 = floor(b0) * 2.0 + 1.0;
+    vec4 s1 = floor(b1) * 2.0 + 1.0;
+    vec4 sh = -step(h, vec4(0.0));
+
+    vec4 a0 = b0.xzyw + s0.xzyw * sh.xxyy;
+    vec4 a1 = b1.xzyw + s1.xzyw * sh.zzww;
+
+    vec3 p0 = vec3(a0.xy, h.x);
+    vec3 p1 = vec3(a0.zw, h.y);
+    vec3 p2 = vec3(a1.xy, h.z);
+    vec3 p3 = vec3(a1.zw, h.w);
+
+    // Normalise gradients
+    vec4 norm = taylorInvSqrt(vec4(dot(p0, p0), dot(p1, p1), dot(p2, p2), dot(p3, p3)));
+    p0 *= norm.x;
+    p1 *= norm.y;
+    p2 *= norm.z;
+    p3 *= norm.w;
+
+    // Mix final noise value
+    vec4 m = max(0.6 - vec4(dot(x0, x0), dot(x1, x1), dot(x2, x2), dot(x3, x3)), 0.0);
+    vec4 m2 = m * m;
+    vec4 m4 = m2 * m2;
+    vec4 pdotx = vec4(dot(p0, x0), dot(p1, x1), dot(p2, x2), dot(p3, x3));
+
+    // Determine noise gradient
+    vec4 temp = m2 * m * pdotx;
+    gradient = -8.0 * (temp.x * x0 + temp.y * x1 + temp.z * x2 + temp.w * x3);
+    gradient += m4.x * p0 + m4.y * p1 + m4.z * p2 + m4.w * p3;
+    gradient *= 42.0;
+
+    return 42.0 * dot(m4, pdotx);
+}
+
+/* End of Simplex Noise */
+
+float noise(vec3 x, out vec3 gradient) {
+    float sum = 0.0;
+    float amplitude = 1.0;
+    float frequency = 1.0;
+    gradient = vec3(0.0);
+    for (int i = 0; i < 4; ++i) {
+        vec3 octave_gradient;
+        sum += amplitude * snoise(frequency * x, octave_gradient);
+        gradient += amplitude * frequency * octave_gradient;
+        amplitude *= 0.5;
+        frequency *= 2.0;
+    }
+
+    gradient /= 1.875;
+    return sum / 1.875;
+}
+
+void main() {
+    vec2 xz_position = origin + cell_size * floor(gl_FragCoord.xy);
+
+    // height and exact normal from a single noise evaluation
+    vec3 gradient;
+    float h = noise(vec3(POSITION_SCALING_FACTOR * xz_position, TIME_SCALING_FACTOR * time), gradient);
+    vec2 slope = POSITION_SCALING_FACTOR * gradient.xy;
+
+    height_normal = vec4(h, normalize(vec3(-slope.x, 1.0, -slope.y)));
+}
@@ -0,0 +1,75 @@
+#!/usr/bin/env python3
+
+import OpenGL.GL as GL
+import numpy as np
+
+from core.gl_state import gl_state
+from core.shader import Shader
+
+
+VERTEX_SHADER_NAME = 'water/heightmap.vert'
+FRAGMENT_SHADER_NAME = 'water/heightmap.frag'
+
+
+class Heightmap:
+    """ Water height and normal rendered once per frame into a float texture
+        array, one square layer of size x size texels per clipmap level """
+    def __init__(self, size, nb_levels):
+        self.size = size
+        self.nb_levels = nb_levels
+
+        self.shader = Shader.cached(VERTEX_SHADER_NAME, FRAGMENT_SHADER_NAME)
+        names = ['time', 'origin', 'cell_size']
+        self.locations = {name: GL.glGetUniformLocation(self.shader.glid, name) for name in names}
+
+        # the full screen triangle has no attribute, but core profile needs a vertex array
+        self.vertex_array_glid = GL.glGenVertexArrays(1)
+
+        self.texture_glid = GL.glGenTextures(1)
+        gl_state.bind_texture(0, GL.GL_TEXTURE_2D_ARRAY, self.texture_glid)
+        GL.glTexImage3D(GL.GL_TEXTURE_2D_ARRAY, 0, GL.GL_RGBA32F, size, size, nb_levels,
+                        0, GL.GL_RGBA, GL.GL_FLOAT, None)
+        GL.glTexParameteri(GL.GL_TEXTURE_2D_ARRAY, GL.GL_TEXTURE_WRAP_S, GL.GL_CLAMP_TO_EDGE)
+        GL.glTexParameteri(GL.GL_TEXTURE_2D_ARRAY, GL.GL_TEXTURE_WRAP_T, GL.GL_CLAMP_TO_EDGE)
+        GL.glTexParameteri(GL.GL_TEXTURE_2D_ARRAY, GL.GL_TEXTURE_MAG_FILTER, GL.GL_LINEAR)
+        GL.glTexParameteri(GL.GL_TEXTURE_2D_ARRAY, GL.GL_TEXTURE_MIN_FILTER, GL.GL_LINEAR)
+
+        self.framebuffer_glid = GL.glGenFramebuffers(1)
+
+        self.origins = np.zeros((nb_levels, 2), np.float32)
+
+    def render(self, time, origins, viewport):
+        """ fill every level from its world (x, z) origin, texels being 2^level
+            apart, then restore the main pass target and its (width, height) viewport """
+        self.origins = np.asarray(origins, np.float32)
+
+        GL.glBindFramebuffer(GL.GL_FRAMEBUFFER, self.framebuffer_glid)
+        GL.glViewport(0, 0, self.size, self.size)
+        GL.glDisable(GL.GL_BLEND)
+        GL.glDisable(GL.GL_DEPTH_TEST)
+
+        gl_state.use_program(self.shader.glid)
+        GL.glUniform1f(self.locations['time'], time)
+        gl_state.bind_vertex_array(self.vertex_array_glid)
+
+        for level, origin in enumerate(self.origins):
+            GL.glFramebufferTextureLayer(GL.GL_FRAMEBUFFER, GL.GL_COLOR_ATTACHMENT0,
+                                            self.texture_glid, 0, level)
+            GL.glUniform2fv(self.locations['origin'], 1, origin)
+            GL.glUniform1f(self.locations['cell_size'], 2 ** level)
+            GL.glDrawArrays(GL.GL_TRIANGLES, 0, 3)
+            gl_state.stats['draw_calls'] += 1
+
+        GL.glEnable(GL.GL_DEPTH_TEST)
+        GL.glEnable(GL.GL_BLEND)
+        GL.glBindFramebuffer(GL.GL_FRAMEBUFFER, gl_state.framebuffer)
+        GL.glViewport(0, 0, *viewport)
+
+    def bind(self, texture_unit):
+        gl_state.bind_texture(texture_unit, GL.GL_TEXTURE_2D_ARRAY, self.texture_glid)
+
+    def __del__(self):
+        GL.glDeleteTextures(self.texture_glid)
+        GL.glDeleteFramebuffers(1, self.framebuffer_glid)
+        GL.glDeleteVertexArrays(1, [self.vertex_array_glid])
+        gl_state.invalidate()
@@ -4,10 +4,7 @@ import numpy as np
 
 
 def vec3(x, y, z):
-    return np.asarray((x, y, z))
-
-def vec4(x, y, z, w):
-    return np.asarray((x, y, z, w))
+    return np.stack(np.broadcast_arrays(x, y, z), axis=-1).astype(float)
 
 def step(edge, x):
     edge = (-2 * (np.abs(edge) < 1e-6) + 1) * edge
@@ -16,15 +13,16 @@ def step(edge, x):
 def floor(x):
     return np.floor(x + 1e-6)
 
-def swizzle3(v, x, y, z):
-    return np.asarray((v[x], v[y], v[z]))
-
-def swizzle4(v, x, y, z, w):
-    return np.asarray((v[x], v[y], v[z], v[w]))
-
 # Simplex Noise
 # from "Efficient computational noise in GLSL" by Ian McEwan et al.
 # https://github.com/ashima/webgl-noise/blob/master/src/noise3D.glsl
+#
+# Vectorized over any number of points: v has shape (..., 3) and the result
+# has shape (...), along with the analytic gradient of shape (..., 3) when
+# asked for. Vector components are kept on the first axis and the four
+# simplex corners on the second one, so that swizzles are plain indexing.
+
+C = np.array((0.0, 1.0, 2.0, 3.0)).reshape(4, 1) / 6.0
 
 def mod289(x):
     return x - floor(x * (1.0 / 289.0)) * 289.0
@@ -35,85 +33,86 @@ def permute(x):
 def taylorInvSqrt(r):
     return 1.79284291400159 - 0.85373472095314 * r
 
-def snoise(v):
-    C_xxx = vec3(1.0 / 6.0, 1.0 / 6.0, 1.0 / 6.0)
-    C_yyy = vec3(1.0 / 3.0, 1.0 / 3.0, 1.0 / 3.0)
-    D = vec4(0.0, 0.5, 1.0, 2.0)
+def snoise(v, gradient=False):
+    v = np.asarray(v, dtype=float)
+    shape = v.shape[:-1]
+    v = v.reshape(-1, 3).T
 
     # First corner
-    i = floor(v + np.dot(v, C_yyy))
-    x0 = v - i + np.dot(i, C_xxx)
+    i = floor(v + np.sum(v, axis=0) * (1.0 / 3.0))
+    x0 = v - i + np.sum(i, axis=0) * (1.0 / 6.0)
 
     # Other corners
-    g = step(swizzle3(x0, 1, 2, 0), x0)
-    l = 1.0 - g
-    l_zxy = swizzle3(l, 2, 0, 1)
-    i1 = np.minimum(g, l_zxy)
-    i2 = np.maximum(g, l_zxy)
+    g = step(x0[[1, 2, 0]], x0)
+    l_zxy = 1.0 - g[[2, 0, 1]]
 
-    x1 = x0 - i1 + C_xxx
-    x2 = x0 - i2 + C_yyy
-    x3 = x0 - swizzle3(D, 1, 1, 1)
+    # (3, 4, N): offsets of the four simplex corners, and the point relative to each
+    offsets = np.empty((3, 4, v.shape[1]))
+    offsets[:, 0] = 0.0
+    offsets[:, 1] = np.minimum(g, l_zxy)
+    offsets[:, 2] = np.maximum(g, l_zxy)
+    offsets[:, 3] = 1.0
+    xs = x0[:, np.newaxis] - offsets + C
 
     # Permutations
-    i = mod289(i)
-    p = permute(permute(permute(
-        i[2] + vec4(0.0, i1[2], i2[2], 1.0))
-        + i[1] + vec4(0.0, i1[1], i2[1], 1.0))
-        + i[0] + vec4(0.0, i1[0], i2[0], 1.0))
+    i = mod289(i)[:, np.newaxis] + offsets
+    p = permute(permute(permute(i[2]) + i[1]) + i[0])
 
     # Gradients: 7x7 points over a square, mapped onto an octahedron.
-    # The ring size 17*17 = 189 is close to a multiple of 49 (49*6 = 294)
+    # The ring size 17*17 = 289 is close to a multiple of 49 (49*6 = 294)
     n_ = 0.142857142857
-    ns = n_ * swizzle3(D, 3, 1, 2) - swizzle3(D, 0, 2, 0)
+    ns_x, ns_y, ns_z = 2.0 * n_, 0.5 * n_ - 1.0, n_
 
-    j = p - 49.0 * floor(p * ns[2] * ns[2])
+    j = p - 49.0 * floor(p * ns_z * ns_z)
 
-    x_ = floor(j * ns[2])
+    x_ = floor(j * ns_z)
     y_ = floor(j - 7.0 * x_)
 
-    ns_yyyy = swizzle4(ns, 1, 1, 1, 1)
-    x = x_ * ns[0] + ns_yyyy
-    y = y_ * ns[0] + ns_yyyy
-    h = 1.0 - np.abs(x) - np.abs(y)
+    gradients = np.empty_like(xs)
+    x = gradients[0] = x_ * ns_x + ns_y
+    y = gradients[1] = y_ * ns_x + ns_y
+    h = gradients[2] = 1.0 - np.abs(x) - np.abs(y)
 
-    b0 = vec4(x[0], x[1], y[0], y[1])
-    b1 = vec4(x[2], x[3], y[2], y[3])
-
-    s0 = floor(b0) * 2.0 + 1.0
-    s1 = floor(b1) * 2.0 + 1.0
     sh = -step(h, 0.0)
-
-    a0 = swizzle4(b0, 0, 2, 1, 3) + swizzle4(s0, 0, 2, 1, 3) * swizzle4(sh, 0, 0, 1, 1)
-    a1 = swizzle4(b1, 0, 2, 1, 3) + swizzle4(s1, 0, 2, 1, 3) * swizzle4(sh, 2, 2, 3, 3)
-
-    p0 = vec3(a0[0], a0[1], h[0])
-    p1 = vec3(a0[2], a0[3], h[1])
-    p2 = vec3(a1[0], a1[1], h[2])
-    p3 = vec3(a1[2], a1[3], h[3])
+    gradients[:2] += (floor(gradients[:2]) * 2.0 + 1.0) * sh
 
     # Normalise gradients
-    norm = taylorInvSqrt(vec4(np.dot(p0, p0), np.dot(p1, p1), np.dot(p2, p2), np.dot(p3, p3)))
-    p0 *= norm[0]
-    p1 *= norm[1]
-    p2 *= norm[2]
-    p3 *= norm[3]
+    gradients *= taylorInvSqrt(np.sum(gradients * gradients, axis=0))
 
     # Mix final noise value
-    m = np.maximum(0.6 - vec4(np.dot(x0, x0), np.dot(x1, x1), np.dot(x2, x2), np.dot(x3, x3)), 0.0)
-    m = m * m
+    m = np.maximum(0.6 - np.sum(xs * xs, axis=0), 0.0)
+    m2 = m * m
+    m4 = m2 * m2
+    pdotx = np.sum(gradients * xs, axis=0)
+
+    value = 42.0 * np.sum(m4 * pdotx, axis=0).reshape(shape)
+    if not gradient:
+        return value
 
-    return 42.0 * np.dot(m * m, vec4(np.dot(p0, x0), np.dot(p1, x1), np.dot(p2, x2), np.dot(p3, x3)))
+    # d(m^4 (p.x))/dv = -8 m^3 (p.x) x + m^4 p, each corner offset x moving with v
+    derivative = np.sum(-8.0 * m2 * m * pdotx * xs + m4 * gradients, axis=1)
+    return value, 42.0 * derivative.T.reshape(shape + (3,))
 
 # End of Simplex Noise
 
-def noise(x):
+def noise(x, gradient=False):
+    """ 4 octaves of simplex noise, at one point (3,) or a batch of points (..., 3),
+        with its gradient when asked for """
+    x = np.asarray(x, dtype=float)
     s = 0.0
+    ds = 0.0
     amplitude = 1.0
     frequency = 1.0
     for _ in range(4):
-        s += amplitude * snoise(frequency * x)
+        if gradient:
+            value, derivative = snoise(frequency * x, True)
+            ds += amplitude * frequency * derivative
+        else:
+            value = snoise(frequency * x)
+        s += amplitude * value
         amplitude *= 0.5
         frequency *= 2.0
 
+    if gradient:
+        return s / 1.875, ds / 1.875
     return s / 1.875
@@ -1,15 +1,24 @@
 #!/usr/bin/env python3
 
-from math import sqrt
+import ctypes
 
 import OpenGL.GL as GL
+import numpy as np
 
+from core.gl_state import gl_state
+from core.profiler import profiler
 from core.shader import Shader
 from core.mesh import Mesh
+from core.transform import frustum_planes, boxes_in_frustum
 from water.noise import vec3, noise
+from water.heightfield import HeightfieldCache
+from water.grid import rectangle, clipmap_shapes, clipmap_corners, clipmap_instances
+from water.heightmap import Heightmap
 
 
-RADIUS = 160
+CLIPMAP_BLOCK = 16
+CLIPMAP_LEVELS = 6
+WAVE_AMPLITUDE = 1
 VERTEX_SHADER_NAME = 'water/water.vert'
 FRAGMENT_SHADER_NAME = 'water/water.frag'
 POSITION_SCALING_FACTOR = 0.25
@@ -17,49 +26,70 @@ TIME_SCALING_FACTOR = 0.25
 
 
 class Water(Mesh):
-    def __init__(self, lights_manager, skybox):
+    def __init__(self, lights_manager, skybox, cache_heights=False):
         self.lights_manager = lights_manager
         self.skybox = skybox
+        self.heightfield = None
+        if cache_heights:
+            self.heightfield = HeightfieldCache(POSITION_SCALING_FACTOR, TIME_SCALING_FACTOR)
 
-        shader = Shader(VERTEX_SHADER_NAME, FRAGMENT_SHADER_NAME)
+        shader = Shader.cached(VERTEX_SHADER_NAME, FRAGMENT_SHADER_NAME)
         self.lights_manager.add_shader(shader)
 
-        position = []
-        axis = []
-        x_ranges = []
-        for z in range(-RADIUS + 1, RADIUS):
-            x_range = int(sqrt(RADIUS * RADIUS - z * z))
-            x_ranges.append(x_range)
-            for x in range(-x_range, x_range + 1):
-                position.append((x, z))
-                axis.append((-1,))
-                position.append((x, z + 1))
-                axis.append((1,))
-
-        index = []
-        z_offset = 0
-        for x_range in x_ranges:
-            for x in range(-x_range, x_range):
-                offset = z_offset + 2 * (x + x_range)
-                index += [offset + 1, offset + 3, offset, offset + 2, offset, offset + 3]
-
-            z_offset += 2 * (2 * x_range + 1)
-
-        super().__init__(shader, (position, axis), index)
-
-        self.add_locations('time', 'w_camera_position', 'env_tex_back', 'env_tex_front', 'env_rotation')
+        # one grid per clipmap patch shape, packed in the same buffers
+        positions, indices = [], []
+        self.patches = {}
+        nb_vertices, nb_indices = 0, 0
+        for name, (width, depth) in clipmap_shapes(CLIPMAP_BLOCK).items():
+            position, index = rectangle(width, depth)
+            positions.append(position)
+            indices.append(index + nb_vertices)
+            self.patches[name] = (nb_indices, len(index), (width, depth))
+            nb_vertices += len(position)
+            nb_indices += len(index)
+
+        super().__init__(shader, (np.concatenate(positions),), np.concatenate(indices))
+
+        # clipmap levels with a margin around morphed vertices
+        self.heightmap = Heightmap(4 * CLIPMAP_BLOCK + 4, CLIPMAP_LEVELS)
+
+        # per instance patch origin, cell size and level, streamed every frame
+        self.instance_buffer = GL.glGenBuffers(1)
+        self.vertex_array.buffers.append(self.instance_buffer)
+        gl_state.bind_vertex_array(self.vertex_array.glid)
+        GL.glBindBuffer(GL.GL_ARRAY_BUFFER, self.instance_buffer)
+        GL.glEnableVertexAttribArray(2)
+        GL.glVertexAttribDivisor(2, 1)
+        gl_state.bind_vertex_array(0)
+
+        self.add_locations('w_camera_position', 'env_tex_back', 'env_tex_front', 'env_rotation',
+                            'morph_range', 'heightmap', 'heightmap_origins')
 
         self.current_time = 0
+        self.stats = {'triangles': 0, 'culled_triangles': 0}
 
     def update(self, delta_time):
         self.current_time += delta_time
 
-    def draw(self, projection, view, model, normal_matrix, camera):
-        GL.glUseProgram(self.shader.glid)
+    def draw(self, projection, view, model, camera):
+        self._render_heightmap(camera)
+        self._draw_patches(projection, view, camera)
+
+    def queue(self, render_queue, projection, view, model, camera):
+        # the heightmap pass renders into its own framebuffer, ahead of the queued items
+        self._render_heightmap(camera)
+        render_queue.add(lambda: self._draw_patches(projection, view, camera), self.shader.glid, name='Water')
 
-        GL.glUniform1f(self.locations['time'], self.current_time)
+    def _render_heightmap(self, camera):
+        x, _, z = camera.position
+        cell_sizes = 2.0 ** np.arange(CLIPMAP_LEVELS)[:, np.newaxis]
+        origins = clipmap_corners(x, z, CLIPMAP_BLOCK, CLIPMAP_LEVELS) - 2 * cell_sizes
+        with profiler.scope('water heightmap'):
+            self.heightmap.render(self.current_time, origins, camera.viewport)
 
-        self.lights_manager.set_uniforms(self.shader, 0)
+    def _draw_patches(self, projection, view, camera):
+        x, _, z = camera.position
+        gl_state.use_program(self.shader.glid)
 
         self.skybox.back.bind(1)
         GL.glUniform1i(self.locations['env_tex_back'], 1)
@@ -67,12 +97,75 @@ class Water(Mesh):
         GL.glUniform1i(self.locations['env_tex_front'], 2)
         GL.glUniformMatrix4fv(self.locations['env_rotation'], 1, True, self.skybox.rotation)
 
+        self.heightmap.bind(3)
+        GL.glUniform1i(self.locations['heightmap'], 3)
+        GL.glUniform2fv(self.locations['heightmap_origins'], CLIPMAP_LEVELS, self.heightmap.origins)
+
         GL.glUniform3fv(self.locations['w_camera_position'], 1, camera.position)
 
-        super().draw(projection, view, model, normal_matrix, camera)
+        # vertices morph to the coarser grid between m and 2m - 2 cells away from the camera
+        GL.glUniform2f(self.locations['morph_range'], CLIPMAP_BLOCK, 2 * CLIPMAP_BLOCK - 2)
+
+        GL.glUniformMatrix4fv(self.locations['view'], 1, True, view)
+        GL.glUniformMatrix4fv(self.locations['projection'], 1, True, projection)
+
+        instances = self._visible_instances(x, z, projection @ view)
+
+        gl_state.bind_vertex_array(self.vertex_array.glid)
+        GL.glBindBuffer(GL.GL_ARRAY_BUFFER, self.instance_buffer)
+        GL.glBufferData(GL.GL_ARRAY_BUFFER, np.concatenate(list(instances.values())), GL.GL_STREAM_DRAW)
+
+        first_instance = 0
+        for name, (first_index, nb_indices, _) in self.patches.items():
+            nb_instances = len(instances[name])
+            if nb_instances > 0:
+                GL.glVertexAttribPointer(2, 4, GL.GL_FLOAT, False, 0, ctypes.c_void_p(16 * first_instance))
+                GL.glDrawElementsInstanced(GL.GL_TRIANGLES, nb_indices, GL.GL_UNSIGNED_INT,
+                                            ctypes.c_void_p(4 * first_index), nb_instances)
+                gl_state.stats['draw_calls'] += 1
+            first_instance += nb_instances
+
+    def _visible_instances(self, x, z, viewproj):
+        """ clipmap patches around (x, z) intersecting the view frustum """
+        planes = frustum_planes(viewproj)
+        self.stats['triangles'], self.stats['culled_triangles'] = 0, 0
+
+        instances = clipmap_instances(x, z, CLIPMAP_BLOCK, CLIPMAP_LEVELS)
+        for name, (_, nb_indices, (width, depth)) in self.patches.items():
+            patches = instances[name]
+            cell_sizes = patches[:, 2]
+
+            # conservative bounds: whole wave amplitude, one more cell for morphed vertices
+            lower = np.stack((patches[:, 0] - cell_sizes,
+                                np.full(len(patches), -WAVE_AMPLITUDE),
+                                patches[:, 1] - cell_sizes), axis=-1)
+            upper = np.stack((patches[:, 0] + (width + 1) * cell_sizes,
+                                np.full(len(patches), WAVE_AMPLITUDE),
+                                patches[:, 1] + (depth + 1) * cell_sizes), axis=-1)
+            visible = boxes_in_frustum(planes, lower, upper)
+
+            instances[name] = patches[visible]
+            self.stats['triangles'] += nb_indices // 3 * len(patches)
+            self.stats['culled_triangles'] += nb_indices // 3 * int(np.count_nonzero(~visible))
+
+        return instances
 
     def height(self, x, z):
+        return float(self.heights(x, z))
+
+    def heights(self, xs, zs, cached=True):
+        """ water heights at many (x, z) positions, in a single noise evaluation or cache
+            lookup, the noise being evaluated directly for positions too sparse to cache """
+        if self.heightfield is not None and cached:
+            return self.heightfield.heights(xs, zs, self.current_time)
+
         return noise(vec3(
-                        POSITION_SCALING_FACTOR * x,
-                        POSITION_SCALING_FACTOR * z,
+                        POSITION_SCALING_FACTOR * np.asarray(xs),
+                        POSITION_SCALING_FACTOR * np.asarray(zs),
                         TIME_SCALING_FACTOR * self.current_time))
+
+    def prefetch(self, x, z, radius):
+        """ announce upcoming height queries around (x, z), when heights are cached """
+        if self.heightfield is not None:
+            self.heightfield.prefetch(x, z, radius, self.current_time)
+